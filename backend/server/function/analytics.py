@@ -0,0 +1,164 @@
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, UpdateOne
+from .models import Post, PostResult, PublishStats, SocialAccount
+
+# Reporting reads per user/platform/day counters instead of scanning
+# post_results. publish_post bumps them with $inc as it saves results, and
+# the backfill_publish_stats command rebuilds them from post_results. Failure
+# messages are free text from the platforms, so they are bucketed into a few
+# reasons; the first matching pattern wins.
+FAILURE_REASONS = [
+    ('not_configured', re.compile(r'not configured|is required|requires an image', re.I)),
+    ('circuit_open', re.compile(r'circuit open|disabled - ', re.I)),
+    ('timeout', re.compile(r'timed out|timeout|outcome unknown', re.I)),
+    ('rate_limited', re.compile(r'too many requests|rate limit|retry after|flood|throttl|\b429\b', re.I)),
+    ('auth', re.compile(r'login|unauthori[sz]ed|forbidden|oauth|access token|\b40[13]\b', re.I)),
+    ('network', re.compile(r'connection|network|name resolution|ssl', re.I)),
+    ('rejected', re.compile(r'bad request|invalid|\b400\b', re.I)),
+]
+
+# Window served when the client asks for no dates, and the widest allowed
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS", "30"))
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "366"))
+
+class PublishAnalytics:
+
+    @staticmethod
+    def classify(message):
+        for reason, pattern in FAILURE_REASONS:
+            if pattern.search(message or ''):
+                return reason
+        return 'other'
+
+    @staticmethod
+    def day(when):
+        return datetime(when.year, when.month, when.day)
+
+    @staticmethod
+    def increments(user_id, results, when):
+        """One upserting $inc per platform for a publish's results"""
+        ops = []
+        day = PublishAnalytics.day(when)
+        for result in results:
+            inc = {'attempts': 1, 'successes': 0, 'failures': 0}
+            if result['success']:
+                inc['successes'] = 1
+            else:
+                inc['failures'] = 1
+                inc[f"failure_reasons.{PublishAnalytics.classify(result['message'])}"] = 1
+            ops.append(UpdateOne(
+                {'user': user_id, 'day': day, 'platform': result['platform']},
+                {'$inc': inc},
+                upsert=True,
+            ))
+        return ops
+
+    @staticmethod
+    def backfill(since=None):
+        """Recompute the rollups from post_results, for whole days from ``since`` on
+
+        Rows are replaced, not incremented, so the command can be re-run.
+        Returns the number of rollup rows written.
+        """
+        match = {}
+        if since:
+            match['posted_at'] = {'$gte': PublishAnalytics.day(since)}
+        pipeline = [
+            {'$match': match},
+            {'$lookup': {'from': Post._get_collection_name(), 'localField': 'post', 'foreignField': '_id', 'as': 'post'}},
+            {'$lookup': {'from': SocialAccount._get_collection_name(), 'localField': 'platform', 'foreignField': '_id', 'as': 'account'}},
+            {'$unwind': '$post'},
+            {'$unwind': '$account'},
+            {'$group': {
+                '_id': {
+                    'user': '$post.user',
+                    'platform': '$account.platform',
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$posted_at'}},
+                    'success': '$success',
+                    'message': '$error_message',
+                },
+                'count': {'$sum': 1},
+            }},
+        ]
+
+        rows = defaultdict(lambda: {'attempts': 0, 'successes': 0, 'failures': 0, 'failure_reasons': defaultdict(int)})
+        for group in PostResult._get_collection().aggregate(pipeline, allowDiskUse=True):
+            key = group['_id']
+            row = rows[(key['user'], key['platform'], datetime.strptime(key['day'], '%Y-%m-%d'))]
+            row['attempts'] += group['count']
+            if key['success']:
+                row['successes'] += group['count']
+            else:
+                row['failures'] += group['count']
+                row['failure_reasons'][PublishAnalytics.classify(key.get('message'))] += group['count']
+
+        ops = [
+            ReplaceOne(
+                {'user': user_id, 'day': day, 'platform': platform},
+                {'user': user_id, 'day': day, 'platform': platform, **row, 'failure_reasons': dict(row['failure_reasons'])},
+                upsert=True,
+            )
+            for (user_id, platform, day), row in rows.items()
+        ]
+        collection = PublishStats._get_collection()
+        for start in range(0, len(ops), 1000):
+            collection.bulk_write(ops[start:start + 1000], ordered=False)
+        return len(ops)
+
+    @staticmethod
+    def summary(user_id, start, end, platform=None):
+        """Totals, per-platform figures and a daily series for days in [start, end]"""
+        query = PublishStats.objects(user=user_id, day__gte=start, day__lte=end)
+        if platform:
+            query = query.filter(platform=platform)
+
+        def empty():
+            return {'attempts': 0, 'successes': 0, 'failures': 0, 'failure_reasons': defaultdict(int)}
+
+        totals, platforms, daily = empty(), defaultdict(empty), []
+        for row in query.order_by('day', 'platform').as_pymongo():
+            for bucket in (totals, platforms[row['platform']]):
+                for field in ('attempts', 'successes', 'failures'):
+                    bucket[field] += row.get(field, 0)
+                for reason, count in (row.get('failure_reasons') or {}).items():
+                    bucket['failure_reasons'][reason] += count
+            daily.append({
+                'day': row['day'].date().isoformat(),
+                'platform': row['platform'],
+                'attempts': row.get('attempts', 0),
+                'successes': row.get('successes', 0),
+                'failures': row.get('failures', 0),
+            })
+
+        def finish(bucket):
+            attempts = bucket['attempts']
+            return {
+                **bucket,
+                'failure_reasons': dict(bucket['failure_reasons']),
+                'success_rate': round(bucket['successes'] / attempts, 4) if attempts else None,
+            }
+
+        return {
+            'from': start.date().isoformat(),
+            'to': end.date().isoformat(),
+            'totals': finish(totals),
+            'platforms': {name: finish(bucket) for name, bucket in platforms.items()},
+            'daily': daily,
+        }
+
+    @staticmethod
+    def date_range(start=None, end=None):
+        """(start, end) days from optional YYYY-MM-DD strings; raises ValueError if invalid"""
+        try:
+            end = datetime.strptime(end, '%Y-%m-%d') if end else PublishAnalytics.day(datetime.utcnow())
+            start = datetime.strptime(start, '%Y-%m-%d') if start else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+        except ValueError:
+            raise ValueError("Dates must be YYYY-MM-DD")
+        if start > end:
+            raise ValueError("from must not be after to")
+        if (end - start).days >= ANALYTICS_MAX_DAYS:
+            raise ValueError(f"Range is limited to {ANALYTICS_MAX_DAYS} days")
+        return start, end
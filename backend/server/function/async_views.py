@@ -0,0 +1,201 @@
+import os
+import json
+import asyncio
+import functools
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from .authentication import BearerTokenAuthentication
+from .clients import get_motor_db, run_on_client_loop
+from .models import Post, PublishJob
+from .services import PostingService
+
+# Native async views. Under ASGI (uvicorn server.asgi:application) a publish
+# awaits Telegram and the Graph API on the server's event loop, so waiting
+# requests hold no thread. DRF 3.14 views are sync-only, hence plain Django
+# views answering with the same JSON shapes.
+
+# Progress streams send each platform result as it lands, as Server-Sent
+# Events or, with ?format=ndjson, one JSON object per line. Idle streams get a
+# heartbeat every PUBLISH_STREAM_HEARTBEAT seconds so proxies keep them open;
+# job streams re-read the job every PUBLISH_STREAM_POLL_INTERVAL seconds.
+PUBLISH_STREAM_HEARTBEAT = float(os.getenv("PUBLISH_STREAM_HEARTBEAT", "15"))
+PUBLISH_STREAM_POLL_INTERVAL = float(os.getenv("PUBLISH_STREAM_POLL_INTERVAL", "0.5"))
+
+# Publishes started by a stream finish and save even if the client goes away
+_background_publishes = set()
+
+def async_api_view(view):
+    """Token-authenticated async view, so exempt from CSRF like the DRF views
+
+    Django 4.2's csrf_exempt returns a sync wrapper, which would hide the
+    coroutine. Outside ASGI the view runs on the shared client loop.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if isinstance(request, ASGIRequest):
+            return await view(request, *args, **kwargs)
+        return await run_on_client_loop(view(request, *args, **kwargs))
+    wrapper.csrf_exempt = True
+    return wrapper
+
+def asgi_required(request):
+    """Error response for streams under WSGI, which buffers them on a throwaway loop"""
+    if isinstance(request, ASGIRequest):
+        return None
+    return JsonResponse({'error': 'Progress streams need the ASGI server (uvicorn server.asgi:application)'}, status=501)
+
+async def authenticate(request):
+    """The request's Principal, or None; session and principal lookups are mostly cached"""
+    result = await sync_to_async(BearerTokenAuthentication().authenticate, thread_sensitive=False)(request)
+    return result[0] if result else None
+
+def wants_ndjson(request):
+    return request.GET.get('format') == 'ndjson' or 'application/x-ndjson' in request.META.get('HTTP_ACCEPT', '')
+
+def stream_response(request, events):
+    """Wrap an async iterator of (event, data) pairs; ``data`` None is a heartbeat"""
+    ndjson = wants_ndjson(request)
+
+    async def encode():
+        async for event, data in events:
+            if ndjson:
+                yield json.dumps({'event': event, 'data': data}) + '\n'
+            elif data is None:
+                yield ': ping\n\n'
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    response = StreamingHttpResponse(encode(), content_type='application/x-ndjson' if ndjson else 'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx would otherwise hold events back
+    return response
+
+async def owned_post_id(request, pk):
+    """(post id, None) for a post owned by the requester, or (None, error response)"""
+    principal = await authenticate(request)
+    if not principal:
+        return None, JsonResponse({'error': 'Not authenticated'}, status=401)
+    try:
+        post_id = ObjectId(pk)
+    except InvalidId:
+        return None, JsonResponse({'error': 'Post not found'}, status=404)
+    posts = get_motor_db()[Post._get_collection_name()]
+    if not await posts.find_one({'_id': post_id, 'user': principal.id}, {'_id': 1}):
+        return None, JsonResponse({'error': 'Post not found'}, status=404)
+    return post_id, None
+
+def read_publish_data(request):
+    return {
+        'platforms': json.loads(request.POST.get('platforms', '{}')),
+        'credentials': json.loads(request.POST.get('credentials', '{}'))
+    }
+
+@async_api_view
+async def publish_post(request, pk):
+    """POST /api/posts/{id}/publish/ - publish to the selected platforms and return their results"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    post_id, error = await owned_post_id(request, pk)
+    if error:
+        return error
+    
+    try:
+        publish_data = read_publish_data(request)
+    except ValueError:
+        return JsonResponse({'error': 'platforms and credentials must be JSON'}, status=400)
+    
+    results = await PostingService.publish_post(str(post_id), publish_data)
+    return JsonResponse({'results': results})
+
+@async_api_view
+async def publish_post_stream(request, pk):
+    """POST /api/posts/{id}/publish/stream/ - like publish, streaming a ``result`` event per platform, then ``done``"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    unsupported = asgi_required(request)
+    if unsupported:
+        return unsupported
+    post_id, error = await owned_post_id(request, pk)
+    if error:
+        return error
+    
+    try:
+        publish_data = read_publish_data(request)
+    except ValueError:
+        return JsonResponse({'error': 'platforms and credentials must be JSON'}, status=400)
+    
+    async def events():
+        queue = asyncio.Queue()
+        task = asyncio.ensure_future(PostingService.publish_post(str(post_id), publish_data, on_result=queue.put))
+        _background_publishes.add(task)
+        task.add_done_callback(_background_publishes.discard)
+        
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, task}, timeout=PUBLISH_STREAM_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield 'result', getter.result()
+                continue
+            getter.cancel()
+            if task in done:
+                while not queue.empty():
+                    yield 'result', queue.get_nowait()
+                yield 'done', {'results': task.result()}
+                return
+            yield 'ping', None
+    
+    return stream_response(request, events())
+
+@async_api_view
+async def publish_job_stream(request, pk):
+    """GET /api/jobs/{id}/stream/ - a background publish job's ``status`` changes and ``result`` events, then ``done``"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    unsupported = asgi_required(request)
+    if unsupported:
+        return unsupported
+    principal = await authenticate(request)
+    if not principal:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    try:
+        job_id = ObjectId(pk)
+    except InvalidId:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    jobs = get_motor_db()[PublishJob._get_collection_name()]
+    query = {'_id': job_id, 'user': principal.id}
+    projection = {'status': 1, 'results': 1, 'error_message': 1}
+    if not await jobs.find_one(query, {'_id': 1}):
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    
+    async def events():
+        loop = asyncio.get_running_loop()
+        status = None
+        sent = 0
+        last_event = loop.time()
+        while True:
+            job = await jobs.find_one(query, projection)
+            if not job:
+                yield 'done', {'status': 'deleted', 'results': []}
+                return
+            results = job.get('results') or []
+            sent = min(sent, len(results))  # a retried job starts its results over
+            if job['status'] != status:
+                status = job['status']
+                yield 'status', {'status': status}
+                last_event = loop.time()
+            for result in results[sent:]:
+                yield 'result', result
+                last_event = loop.time()
+            sent = len(results)
+            if status in ('done', 'failed'):
+                yield 'done', {'status': status, 'results': results, 'error_message': job.get('error_message')}
+                return
+            if loop.time() - last_event >= PUBLISH_STREAM_HEARTBEAT:
+                yield 'ping', None
+                last_event = loop.time()
+            await asyncio.sleep(PUBLISH_STREAM_POLL_INTERVAL)
+    
+    return stream_response(request, events())
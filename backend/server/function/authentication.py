@@ -0,0 +1,80 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from bson import ObjectId
+from rest_framework.authentication import BaseAuthentication
+from .models import User
+from .sessions import get_session_store
+
+# Resolving a token costs a session lookup (itself cached, see
+# function.sessions) plus the user's id, username and email. Principals are
+# cached per process for PRINCIPAL_CACHE_TTL seconds; profile and password
+# changes drop the entry here, and other processes catch up within the TTL.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+class Principal:
+    """The authenticated user as views see it: enough to scope queries, no password hash"""
+    __slots__ = ('id', 'username', 'email', 'is_staff')
+    is_authenticated = True
+
+    def __init__(self, id, username, email, is_staff=False):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_staff = is_staff
+
+class PrincipalCache:
+    _entries = OrderedDict()  # user id -> (Principal, cached at)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(user_id):
+        """Principal for a user id string, or None if the user no longer exists"""
+        now = time.monotonic()
+        with PrincipalCache._lock:
+            entry = PrincipalCache._entries.get(user_id)
+            if entry and now - entry[1] < PRINCIPAL_CACHE_TTL:
+                PrincipalCache._entries.move_to_end(user_id)
+                return entry[0]
+
+        row = User.objects(id=ObjectId(user_id)).only('username', 'email', 'is_staff').as_pymongo().first()
+        if not row:
+            PrincipalCache.invalidate(user_id)
+            return None
+        principal = Principal(row['_id'], row.get('username'), row.get('email'), bool(row.get('is_staff')))
+        with PrincipalCache._lock:
+            PrincipalCache._entries[user_id] = (principal, now)
+            PrincipalCache._entries.move_to_end(user_id)
+            while len(PrincipalCache._entries) > PRINCIPAL_CACHE_SIZE:
+                PrincipalCache._entries.popitem(last=False)
+        return principal
+
+    @staticmethod
+    def invalidate(user_id):
+        with PrincipalCache._lock:
+            PrincipalCache._entries.pop(str(user_id), None)
+
+class BearerTokenAuthentication(BaseAuthentication):
+    """Sets ``request.user`` to a Principal and ``request.auth`` to the token
+
+    Missing or invalid tokens leave the request anonymous (``request.user`` is
+    None) so views keep answering with their own ``{'error': ...}`` bodies.
+    """
+
+    def authenticate(self, request):
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if not header.startswith('Bearer '):
+            return None
+        token = header[len('Bearer '):]
+        user_id = get_session_store().get(token)
+        if not user_id:
+            return None
+        principal = PrincipalCache.get(user_id)
+        if principal is None:
+            return None
+        return principal, token
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+from datetime import datetime
+
+# After CIRCUIT_FAILURE_THRESHOLD consecutive transient failures (timeouts,
+# network errors, 5xx/429) a destination is skipped for
+# CIRCUIT_RECOVERY_TIMEOUT seconds, then a single trial call decides whether
+# it is healthy again. Rejected content or missing credentials say nothing
+# about the platform's health and are not counted.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", "60"))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
+# Platforms held open until an operator resets them, e.g. "instagram=IP banned"
+CIRCUIT_FORCED_OPEN = os.getenv("CIRCUIT_FORCED_OPEN", "")
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout=CIRCUIT_RECOVERY_TIMEOUT, half_open_calls=CIRCUIT_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_calls = 0
+        self.opened_at = None
+        self.last_error = None
+        self.last_changed = datetime.utcnow()
+        self.forced_reason = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.last_changed = datetime.utcnow()
+
+    def allow(self):
+        """Return True if a call may go through right now"""
+        with self._lock:
+            if self.forced_reason:
+                return False
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.recovery_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+                self.opened_at = now
+                self.trial_calls = 0
+            if self.state == self.HALF_OPEN:
+                if self.trial_calls >= self.half_open_calls:
+                    # A trial that never reported back must not wedge the breaker
+                    if now - self.opened_at < self.recovery_timeout:
+                        return False
+                    self.opened_at = now
+                    self.trial_calls = 0
+                self.trial_calls += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_calls = 0
+            self._set_state(self.CLOSED)
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def release(self):
+        """Give back a trial slot for a call that proved nothing either way"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.trial_calls > 0:
+                self.trial_calls -= 1
+
+    def force_open(self, reason):
+        with self._lock:
+            self.forced_reason = reason
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def reset(self):
+        with self._lock:
+            self.forced_reason = None
+            self.failures = 0
+            self.trial_calls = 0
+            self._set_state(self.CLOSED)
+
+    def unavailable_message(self, label):
+        if self.forced_reason:
+            return f"{label} disabled - {self.forced_reason}"
+        retry_in = max(0, int(self.recovery_timeout - (time.monotonic() - self.opened_at)))
+        return f"{label} unavailable (circuit open, retry in {retry_in}s): {self.last_error}"
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'failures': self.failures,
+                'last_error': self.last_error,
+                'forced_reason': self.forced_reason,
+                'last_changed': self.last_changed.isoformat(),
+            }
+
+class CircuitBreakers:
+    """Process-wide registry of breakers, one per platform and per account
+
+    State is kept in memory, so each web and worker process trips and recovers
+    independently; the circuit endpoints only see the web process that answers.
+    """
+    _breakers = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(platform, account_id=None):
+        name = f"{platform}:{account_id}" if account_id else platform
+        breaker = CircuitBreakers._breakers.get(name)
+        if breaker is None:
+            with CircuitBreakers._lock:
+                breaker = CircuitBreakers._breakers.get(name)
+                if breaker is None:
+                    breaker = CircuitBreaker(name)
+                    reason = CircuitBreakers.forced_open().get(name)
+                    if reason:
+                        breaker.force_open(reason)
+                    CircuitBreakers._breakers[name] = breaker
+        return breaker
+
+    @staticmethod
+    def forced_open():
+        forced = {}
+        for entry in CIRCUIT_FORCED_OPEN.split(','):
+            name, _, reason = entry.partition('=')
+            if name.strip():
+                forced[name.strip()] = reason.strip() or 'disabled by configuration'
+        return forced
+
+    @staticmethod
+    def snapshot():
+        for name in CircuitBreakers.forced_open():
+            CircuitBreakers.get(*name.split(':', 1))
+        with CircuitBreakers._lock:
+            breakers = list(CircuitBreakers._breakers.values())
+        return [breaker.snapshot() for breaker in sorted(breakers, key=lambda b: b.name)]
@@ -0,0 +1,122 @@
+import os
+import asyncio
+import threading
+import weakref
+import httpx
+import requests
+from django.conf import settings
+from motor.motor_asyncio import AsyncIOMotorClient
+from requests.adapters import HTTPAdapter
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+# Shared keep-alive clients for outbound platform calls, so a publish does not
+# pay for a fresh TCP+TLS handshake every time.
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+STABILITY_READ_TIMEOUT = float(os.getenv("STABILITY_READ_TIMEOUT", "120"))
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "30"))
+
+class PooledSession(requests.Session):
+    """requests.Session with a sized connection pool and a default timeout"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+class HttpClients:
+    _sessions = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _session(name, read_timeout):
+        session = HttpClients._sessions.get(name)
+        if session is None:
+            with HttpClients._lock:
+                session = HttpClients._sessions.get(name)
+                if session is None:
+                    session = PooledSession(timeout=(HTTP_CONNECT_TIMEOUT, read_timeout))
+                    HttpClients._sessions[name] = session
+        return session
+
+    @staticmethod
+    def stability():
+        """Client for api.stability.ai; generation is slow, so reads wait longer"""
+        return HttpClients._session('stability', STABILITY_READ_TIMEOUT)
+
+# httpx connections are bound to the event loop that opened them, so bots are
+# cached per loop and dropped together with it.
+_bots = weakref.WeakKeyDictionary()
+
+def get_telegram_bot(token):
+    """Return the cached Bot for this token on the running event loop"""
+    bots = _bots.setdefault(asyncio.get_running_loop(), {})
+    bot = bots.get(token)
+    if bot is None:
+        request = HTTPXRequest(
+            connection_pool_size=TELEGRAM_POOL_SIZE,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            read_timeout=HTTP_READ_TIMEOUT,
+            write_timeout=TELEGRAM_WRITE_TIMEOUT,
+            pool_timeout=HTTP_CONNECT_TIMEOUT,
+        )
+        bot = Bot(token=token, request=request)
+        bots[token] = bot
+    return bot
+
+# Other async clients follow the same rule. An ASGI server runs one long-lived
+# loop and workers run one asyncio.run loop each. Under WSGI asgiref gives every
+# async view a throwaway loop, so those views hop onto client_loop() instead of
+# opening fresh pools per request. Clients of a closed loop are released.
+_loop_clients = {}
+_loop_lock = threading.Lock()
+_client_loop = None
+
+def client_loop():
+    """A process-wide event loop on a daemon thread, for async work started outside ASGI"""
+    global _client_loop
+    with _loop_lock:
+        if _client_loop is None:
+            _client_loop = asyncio.new_event_loop()
+            threading.Thread(target=_client_loop.run_forever, name="async-clients", daemon=True).start()
+        return _client_loop
+
+async def run_on_client_loop(coro):
+    """Await ``coro`` on client_loop(), where its cached clients outlive the caller's loop"""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, client_loop()))
+
+def _loop_client(name, factory):
+    loop = asyncio.get_running_loop()
+    with _loop_lock:
+        for closed in [other for other in _loop_clients if other.is_closed()]:
+            for client in _loop_clients.pop(closed).values():
+                if isinstance(client, AsyncIOMotorClient):
+                    client.close()  # sockets belong to pymongo's pool, not the loop
+        clients = _loop_clients.setdefault(loop, {})
+        client = clients.get(name)
+        if client is None:
+            client = clients[name] = factory(loop)
+        return client
+
+def get_graph_client():
+    """Async client for graph.facebook.com (Facebook pages and WhatsApp Cloud API)"""
+    return _loop_client('graph', lambda loop: httpx.AsyncClient(
+        # Requests queue for a pooled connection; the publish timeout bounds the wait
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=None),
+        limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+    ))
+
+def get_motor_db():
+    """Async (motor) handle on the app database, for the async request path"""
+    client = _loop_client('motor', lambda loop: AsyncIOMotorClient(settings.MONGO_URI, io_loop=loop))
+    return client.get_default_database()
@@ -0,0 +1,127 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+
+# Generated images are cached on disk by prompt and generation parameters.
+# The in-memory index orders entries by last use (file mtime across restarts)
+# and evicts the least recently used ones once IMAGE_CACHE_MAX_BYTES is hit.
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR") or os.path.join(settings.BASE_DIR, 'cache', 'generated')
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+class PromptImageCache:
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total = 0
+        self.loaded = False
+        self.inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt, **params):
+        normalized = ' '.join(prompt.lower().split())
+        payload = json.dumps({'prompt': normalized, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total += size
+        self.loaded = True
+
+    def _add(self, key, size):
+        if key in self.index:
+            self.total -= self.index.pop(key)
+        self.index[key] = size
+        self.total += size
+        evicted = []
+        while self.total > self.max_bytes and len(self.index) > 1:
+            old_key, old_size = self.index.popitem(last=False)
+            self.total -= old_size
+            evicted.append(old_key)
+        return evicted
+
+    def get(self, key):
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            if key in self.index:
+                self.index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if key in self.index:
+                    self.total -= self.index.pop(key)
+            return None
+        # Another process may have written it; adopt it into our index
+        with self._lock:
+            evicted = self._add(key, len(data))
+        self._remove(evicted)
+        return data
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            evicted = self._add(key, len(data))
+        self._remove(evicted)
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get_or_generate(self, key, generate):
+        """Return cached bytes, or call ``generate()`` once for all concurrent callers"""
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            data = generate()
+            self.put(key, data)
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self.inflight.pop(key, None)
+
+prompt_image_cache = PromptImageCache()
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from instagrapi import Client
+from instagrapi.exceptions import LoginRequired
+from .models import InstagramSession
+
+# Logging in on every post is slow and gets accounts flagged, so each
+# account's instagrapi settings (cookies, device ids) are persisted in MongoDB
+# and a bounded number of logged-in clients are kept warm in memory. Sessions
+# belong to the app user who logged in: they are keyed by (user id, Instagram
+# username), so knowing someone else's Instagram username gets you nothing.
+INSTAGRAM_CLIENT_CACHE_SIZE = int(os.getenv("INSTAGRAM_CLIENT_CACHE_SIZE", "16"))
+
+class _WarmClient:
+    def __init__(self):
+        self.client = None
+        self.lock = threading.Lock()  # instagrapi clients are not thread-safe
+
+class InstagramSessionStore:
+    _clients = OrderedDict()  # (user id, username) -> _WarmClient
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _new_client():
+        cl = Client()
+        cl.delay_range = [2, 8]
+        return cl
+
+    @staticmethod
+    def _save(owner, username, cl):
+        InstagramSession.objects(user=owner, username=username).update_one(
+            set__settings=cl.get_settings(), set__updated_at=datetime.utcnow(), upsert=True
+        )
+
+    @staticmethod
+    def _login(owner, username, password, previous=None):
+        """Fresh login, keeping the old device ids so Instagram sees a known device"""
+        if not password:
+            raise LoginRequired("Instagram session expired and no password was provided")
+        cl = InstagramSessionStore._new_client()
+        if previous is not None:
+            cl.set_uuids(previous.get_settings().get('uuids', {}))
+        if not cl.login(username, password):
+            raise LoginRequired("Instagram login failed")
+        InstagramSessionStore._save(owner, username, cl)
+        return cl
+
+    @staticmethod
+    def _open(owner, username, password):
+        """Restore the owner's stored session, logging in again only if it has expired"""
+        stored = InstagramSession.objects(user=owner, username=username).first()
+        if not stored or not stored.settings:
+            return InstagramSessionStore._login(owner, username, password)
+
+        cl = InstagramSessionStore._new_client()
+        cl.set_settings(stored.settings)
+        try:
+            if password:
+                cl.login(username, password)  # no request while the session is valid
+            cl.get_timeline_feed()
+            return cl
+        except LoginRequired:
+            return InstagramSessionStore._login(owner, username, password, previous=cl)
+
+    @staticmethod
+    def _entry(key):
+        with InstagramSessionStore._lock:
+            entry = InstagramSessionStore._clients.get(key)
+            if entry is None:
+                entry = InstagramSessionStore._clients[key] = _WarmClient()
+                while len(InstagramSessionStore._clients) > INSTAGRAM_CLIENT_CACHE_SIZE:
+                    InstagramSessionStore._clients.popitem(last=False)
+            else:
+                InstagramSessionStore._clients.move_to_end(key)
+            return entry
+
+    @staticmethod
+    def default_username(owner):
+        """The Instagram account the user logged in with most recently, or None"""
+        stored = InstagramSession.objects(user=owner).order_by('-updated_at').only('username').first()
+        return stored.username if stored else None
+
+    @staticmethod
+    def run(owner, username, password, action):
+        """Call ``action(client)`` with a client logged in to ``username`` by app user ``owner``"""
+        entry = InstagramSessionStore._entry((str(owner), username))
+        with entry.lock:
+            if entry.client is None:
+                entry.client = InstagramSessionStore._open(owner, username, password)
+            try:
+                return action(entry.client)
+            except LoginRequired:
+                entry.client = InstagramSessionStore._login(owner, username, password, previous=entry.client)
+                return action(entry.client)
+
+    @staticmethod
+    def ensure(owner, username, password):
+        """Make sure ``owner`` has a working stored session for ``username``, logging in if needed"""
+        InstagramSessionStore.run(owner, username, password, lambda cl: None)
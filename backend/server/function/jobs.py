@@ -0,0 +1,196 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from mongoengine.queryset.visitor import Q
+from .models import Post, PublishJob, GenerationJob
+from .services import ImageGenerator, PostingService, run_blocking
+from .media import MediaStore
+
+# A running job whose lease has expired is assumed to belong to a dead worker
+# and is handed to the next worker that asks, up to JOB_MAX_ATTEMPTS times.
+# Live workers renew the lease every third of JOB_LEASE_SECONDS while a job
+# runs, so a slow publish is never taken over.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# How often each worker fails jobs that used up their attempts
+JOB_REAP_INTERVAL = float(os.getenv("JOB_REAP_INTERVAL", "60"))
+GENERATION_MAX_BATCH = int(os.getenv("GENERATION_MAX_BATCH", "50"))
+GENERATION_PARAMS = {'cfg_scale': (0, 35), 'steps': (10, 50), 'height': (128, 1536), 'width': (128, 1536)}
+
+def new_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def claim_job(model, worker_id):
+    """Atomically claim the oldest runnable job of ``model``, or return None"""
+    now = datetime.utcnow()
+    runnable = Q(status='queued') | Q(status='running', lease_expires_at__lt=now, attempts__lt=JOB_MAX_ATTEMPTS)
+    return model.objects(runnable).order_by('created_at').modify(
+        new=True,
+        set__status='running',
+        set__worker_id=worker_id,
+        set__started_at=now,
+        set__lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+        inc__attempts=1,
+    )
+
+def renew_lease(model, job, worker_id):
+    """Push a running job's lease out again; False if another worker has taken it"""
+    return bool(model.objects(id=job.id, worker_id=worker_id, status='running').update_one(
+        set__lease_expires_at=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS),
+    ))
+
+def fail_abandoned_jobs(model, **extra):
+    """Give up on jobs that kept losing their worker"""
+    return model.objects(
+        status='running', lease_expires_at__lt=datetime.utcnow(), attempts__gte=JOB_MAX_ATTEMPTS
+    ).update(
+        set__status='failed',
+        set__error_message='Worker lease expired too many times',
+        set__finished_at=datetime.utcnow(),
+        **extra
+    )
+
+class PublishJobQueue:
+
+    @staticmethod
+    def enqueue(post, user, publish_data):
+        """Queue a post for publishing by a background worker"""
+        return PublishJob(post=post, user=user, publish_data=publish_data).save()
+
+    @staticmethod
+    def claim(worker_id):
+        return claim_job(PublishJob, worker_id)
+
+    @staticmethod
+    def renew(job, worker_id):
+        return renew_lease(PublishJob, job, worker_id)
+
+    @staticmethod
+    def complete(job, worker_id, results):
+        # Jobs hold the Instagram username only, and only while they run
+        return PublishJob.objects(id=job.id, worker_id=worker_id).update_one(
+            set__status='done',
+            set__results=results,
+            set__finished_at=datetime.utcnow(),
+            set__publish_data__credentials={},
+            unset__lease_expires_at=True,
+        )
+
+    @staticmethod
+    def fail(job, worker_id, message):
+        return PublishJob.objects(id=job.id, worker_id=worker_id).update_one(
+            set__status='failed',
+            set__error_message=message,
+            set__finished_at=datetime.utcnow(),
+            set__publish_data__credentials={},
+            unset__lease_expires_at=True,
+        )
+
+    @staticmethod
+    def fail_abandoned():
+        return fail_abandoned_jobs(PublishJob, set__publish_data__credentials={})
+
+    @staticmethod
+    def record_result(job, worker_id, result):
+        """Append one platform's result while the job is still running"""
+        return PublishJob.objects(id=job.id, worker_id=worker_id).update_one(push__results=result)
+
+    @staticmethod
+    def retain_successes(job, worker_id):
+        """Drop a lost attempt's failures, keeping the platforms it already published to"""
+        published = [r for r in job.results if r.get('success')]
+        PublishJob.objects(id=job.id, worker_id=worker_id).update_one(set__results=published)
+        return published
+
+    @staticmethod
+    def mark_posted(post_id):
+        Post.objects(id=post_id).update_one(set__status='posted', set__posted_at=datetime.utcnow())
+
+    @staticmethod
+    async def run(job, worker_id):
+        post_id = str(job.to_mongo()['post'])
+
+        # Results are pushed as each platform finishes, for GET /api/jobs/{id}/stream/
+        async def on_result(result):
+            await run_blocking(PublishJobQueue.record_result, job, worker_id, result)
+
+        try:
+            publish_data, published = job.publish_data, []
+            if job.attempts > 1 and job.results:
+                # A lost attempt may already have posted; publishing those
+                # platforms again would make duplicate public posts
+                published = await run_blocking(PublishJobQueue.retain_successes, job, worker_id)
+                done = {r['platform'] for r in published}
+                platforms = {name: on for name, on in publish_data.get('platforms', {}).items() if name not in done}
+                publish_data = {**publish_data, 'platforms': platforms}
+            results = []
+            if not published or any(publish_data['platforms'].values()):
+                results = await PostingService.publish_post(post_id, publish_data, on_result=on_result)
+            if published and not any(r['success'] for r in results):
+                await run_blocking(PublishJobQueue.mark_posted, post_id)
+            results = published + results
+        except Exception as e:
+            await run_blocking(PublishJobQueue.fail, job, worker_id, str(e))
+            return None
+        await run_blocking(PublishJobQueue.complete, job, worker_id, results)
+        return results
+
+class GenerationJobQueue:
+
+    @staticmethod
+    def clean_params(params):
+        """Keep the supported generation parameters, validated as ints in range"""
+        cleaned = {}
+        for name, (low, high) in GENERATION_PARAMS.items():
+            if params.get(name) is not None:
+                value = int(params[name])
+                if not low <= value <= high:
+                    raise ValueError(f"{name} must be between {low} and {high}")
+                cleaned[name] = value
+        return cleaned
+
+    @staticmethod
+    def enqueue_many(user, prompts, params):
+        """Queue one job per prompt under a shared batch id"""
+        batch_id = uuid.uuid4().hex
+        jobs = [GenerationJob(user=user, batch_id=batch_id, prompt=prompt, params=params) for prompt in prompts]
+        ids = GenerationJob.objects.insert(jobs, load_bulk=False)
+        for job, job_id in zip(jobs, ids):
+            job.id = job_id
+        return batch_id, jobs
+
+    @staticmethod
+    def claim(worker_id):
+        return claim_job(GenerationJob, worker_id)
+
+    @staticmethod
+    def renew(job, worker_id):
+        return renew_lease(GenerationJob, job, worker_id)
+
+    @staticmethod
+    def fail_abandoned():
+        return fail_abandoned_jobs(GenerationJob)
+
+    @staticmethod
+    def execute(job, worker_id):
+        """Generate the image and store it; runs on a worker thread"""
+        try:
+            image = ImageGenerator.generate_image_bytes(job.prompt, **job.params)
+            media_id = MediaStore.save_bytes(image, '.png', 'image/png')
+        except Exception as e:
+            GenerationJob.objects(id=job.id, worker_id=worker_id).update_one(
+                set__status='failed', set__error_message=str(e),
+                set__finished_at=datetime.utcnow(), unset__lease_expires_at=True,
+            )
+            return None
+        GenerationJob.objects(id=job.id, worker_id=worker_id).update_one(
+            set__status='done', set__media_id=media_id,
+            set__finished_at=datetime.utcnow(), unset__lease_expires_at=True,
+        )
+        return media_id
+
+    @staticmethod
+    async def run(job, worker_id):
+        return await run_blocking(GenerationJobQueue.execute, job, worker_id)
+
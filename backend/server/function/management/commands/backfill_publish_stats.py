@@ -0,0 +1,19 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from function.analytics import PublishAnalytics
+
+class Command(BaseCommand):
+    help = "Rebuild the per-day publish analytics rollups from stored post results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="only rebuild days from this date on (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError("--since must be YYYY-MM-DD")
+        written = PublishAnalytics.backfill(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} publish stats rows"))
@@ -0,0 +1,114 @@
+from datetime import datetime
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from function import models
+from function.jobs import JOB_MAX_ATTEMPTS
+from function.pagination import POSTS_PAGE_SIZE
+
+MODELS = [
+    models.User,
+    models.SocialAccount,
+    models.Post,
+    models.PostResult,
+    models.PublishStats,
+    models.PublishJob,
+    models.GenerationJob,
+    models.InstagramSession,
+    models.TelegramFile,
+    models.MediaObject,
+    models.UploadSession,
+    models.UserSession,
+    models.RateLimit,
+]
+
+def merge_duplicate_accounts():
+    """Fold duplicate (user, platform) accounts into the oldest so the unique index can be built
+
+    Works on the raw collections, since touching SocialAccount would try to
+    create the index first. Returns the number of accounts removed.
+    """
+    db = models.SocialAccount._get_db()
+    accounts = db[models.SocialAccount._get_collection_name()]
+    pipeline = [
+        {'$sort': {'_id': 1}},
+        {'$group': {'_id': {'user': '$user', 'platform': '$platform'}, 'ids': {'$push': '$_id'}}},
+        {'$match': {'ids.1': {'$exists': True}}},
+    ]
+    removed = 0
+    for group in accounts.aggregate(pipeline, allowDiskUse=True):
+        keep, duplicates = group['ids'][0], group['ids'][1:]
+        db[models.PostResult._get_collection_name()].update_many(
+            {'platform': {'$in': duplicates}}, {'$set': {'platform': keep}}
+        )
+        posts = db[models.Post._get_collection_name()]
+        posts.update_many({'platforms': {'$in': duplicates}}, {'$addToSet': {'platforms': keep}})
+        posts.update_many({'platforms': {'$in': duplicates}}, {'$pull': {'platforms': {'$in': duplicates}}})
+        removed += accounts.delete_many({'_id': {'$in': duplicates}}).deleted_count
+    return removed
+
+def canonical_queries():
+    """The app's hot queries, as (label, cursor) pairs to explain"""
+    user_id = ObjectId()
+    now = datetime.utcnow()
+    Post, SocialAccount = models.Post, models.SocialAccount
+    return [
+        ("post listing", Post.objects(user=user_id).order_by('-created_at', '-id').limit(POSTS_PAGE_SIZE + 1)),
+        ("post listing by status", Post.objects(user=user_id, status__in=['draft']).order_by('-created_at', '-id').limit(POSTS_PAGE_SIZE + 1)),
+        ("scheduler window", Post._get_collection().find(
+            {'status': 'scheduled', 'scheduled_time': {'$lte': now}}, {'scheduled_time': 1}
+        ).sort('scheduled_time', 1)),
+        ("telegram drafts", Post.objects(status='draft', id__gt=ObjectId.from_datetime(now)).order_by('id')),
+        ("accounts for publish", SocialAccount.objects(user=user_id, platform__in=['telegram', 'facebook'])),
+        ("post results", models.PostResult.objects(post=ObjectId())),
+        ("publish analytics", models.PublishStats.objects(user=user_id, day__gte=now, day__lte=now).order_by('day', 'platform')),
+        ("publish job claim", models.PublishJob.objects(status='queued', attempts__lt=JOB_MAX_ATTEMPTS).order_by('created_at')),
+        ("generation batch", models.GenerationJob.objects(user=user_id, batch_id='x').order_by('created_at')),
+        ("media prune", models.MediaObject.objects(refcount__lte=0, updated_at__lt=now)),
+    ]
+
+def summarize_plan(plan):
+    """Stage chain of a winning plan, e.g. 'LIMIT <- FETCH <- IXSCAN(user_1_created_at_-1)'"""
+    plan = plan.get('queryPlan', plan)  # slot-based engine plans nest the classic plan
+    stages = []
+    while plan:
+        stage = plan.get('stage', '?')
+        if plan.get('indexName'):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return ' <- '.join(stages)
+
+class Command(BaseCommand):
+    help = "Create declared MongoDB indexes, report missing or unused ones and explain hot queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="only report; do not create indexes")
+        parser.add_argument('--explain', action='store_true', help="print query plans for the app's hot queries")
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            removed = merge_duplicate_accounts()
+            if removed:
+                self.stdout.write(f"social_accounts: merged {removed} duplicate accounts")
+        for model in MODELS:
+            name = model._meta['collection']
+            if not options['check']:
+                model.ensure_indexes()
+            diff = model.compare_indexes()
+            for spec in diff['missing']:
+                self.stdout.write(self.style.WARNING(f"{name}: missing index {spec}"))
+            for spec in diff['extra']:
+                self.stdout.write(f"{name}: index not declared in models.py {spec}")
+            for stats in model._get_collection().aggregate([{'$indexStats': {}}]):
+                if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                    since = stats['accesses']['since']
+                    self.stdout.write(f"{name}: index {stats['name']} unused since {since:%Y-%m-%d %H:%M}")
+
+        if options['explain']:
+            for label, cursor in canonical_queries():
+                plan = cursor.explain()['queryPlanner']['winningPlan']
+                summary = summarize_plan(plan)
+                style = self.style.ERROR if 'COLLSCAN' in summary else self.style.SUCCESS
+                self.stdout.write(style(f"{label}: {summary}"))
+
+        self.stdout.write(self.style.SUCCESS("Index check complete"))
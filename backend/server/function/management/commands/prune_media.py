@@ -0,0 +1,17 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from function.media import MediaStore, MEDIA_PRUNE_GRACE
+from function.uploads import ChunkedUploads
+
+class Command(BaseCommand):
+    help = "Delete stored media that no post references any more, and abandoned uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=MEDIA_PRUNE_GRACE,
+                            help="only prune media untouched for this many seconds")
+
+    def handle(self, *args, **options):
+        # Abandoned uploads go first so their committed media can age out too
+        aborted = ChunkedUploads.prune(datetime.utcnow() - timedelta(seconds=options['grace']))
+        removed = MediaStore.prune(options['grace'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {aborted} stale uploads and {removed} unreferenced media objects"))
@@ -0,0 +1,239 @@
+import os
+import re
+import uuid
+import hashlib
+import mimetypes
+from datetime import datetime, timedelta
+from django.conf import settings
+from PIL import Image, ImageOps
+from .models import MediaObject
+
+# Uploads are stored once per distinct content under objects/<aa>/<bb>/<id>,
+# where the media id is the sha256 of the bytes plus the file extension. The
+# path is a pure function of the id, so resolving media never touches the
+# filesystem or the database.
+MEDIA_OBJECTS_DIR = 'objects'
+MEDIA_TMP_DIR = 'tmp'
+MEDIA_PRUNE_GRACE = int(os.getenv("MEDIA_PRUNE_GRACE", "86400"))
+
+# Resized, recompressed copies derived once per original and stored next to
+# it. Originals never change (they are content-addressed), so a variant only
+# goes stale when its spec does; bump MEDIA_VARIANT_VERSION after editing.
+MEDIA_VARIANT_VERSION = 1
+MEDIA_VARIANTS = {
+    'telegram': {'max_size': 2560, 'format': 'JPEG', 'quality': 85},
+    'facebook': {'max_size': 2048, 'format': 'JPEG', 'quality': 85},
+    'instagram': {'max_size': 1080, 'format': 'JPEG', 'quality': 90, 'aspect': (0.8, 1.91)},
+    'whatsapp': {'max_size': 1600, 'format': 'JPEG', 'quality': 80},
+    'thumb': {'max_size': 320, 'format': 'WEBP', 'quality': 75},
+    'thumb_small': {'max_size': 96, 'format': 'WEBP', 'quality': 70},
+}
+VARIANT_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff'}
+
+_EXTENSION = re.compile(r'^\.[a-z0-9]{1,8}$')
+_MEDIA_ID = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$')
+
+class MediaStore:
+
+    @staticmethod
+    def is_media_id(value):
+        return bool(value and _MEDIA_ID.match(value))
+
+    @staticmethod
+    def digest(media_id):
+        return media_id.split('.', 1)[0]
+
+    @staticmethod
+    def relative_path(media_id):
+        return f"{MEDIA_OBJECTS_DIR}/{media_id[:2]}/{media_id[2:4]}/{media_id}"
+
+    @staticmethod
+    def path(media_id):
+        return os.path.join(settings.MEDIA_ROOT, MediaStore.relative_path(media_id))
+
+    @staticmethod
+    def url(media_id):
+        return f"{settings.MEDIA_URL}{MediaStore.relative_path(media_id)}"
+
+    @staticmethod
+    def is_image(media_id):
+        return os.path.splitext(media_id)[1] in IMAGE_EXTENSIONS
+
+    @staticmethod
+    def variant_relative_path(media_id, name):
+        ext = VARIANT_EXTENSIONS[MEDIA_VARIANTS[name]['format']]
+        directory = os.path.dirname(MediaStore.relative_path(media_id))
+        return f"{directory}/{MediaStore.digest(media_id)}.{name}.v{MEDIA_VARIANT_VERSION}{ext}"
+
+    @staticmethod
+    def variant_path(media_id, name):
+        return os.path.join(settings.MEDIA_ROOT, MediaStore.variant_relative_path(media_id, name))
+
+    @staticmethod
+    def variant_url(media_id, name):
+        return f"{settings.MEDIA_URL}{MediaStore.variant_relative_path(media_id, name)}"
+
+    @staticmethod
+    def _render_variant(image, spec):
+        image = image.copy()
+        aspect = spec.get('aspect')
+        if aspect:
+            # Center-crop into the allowed aspect ratio range
+            width, height = image.size
+            ratio = width / height
+            if ratio < aspect[0]:
+                new_height = int(width / aspect[0])
+                top = (height - new_height) // 2
+                image = image.crop((0, top, width, top + new_height))
+            elif ratio > aspect[1]:
+                new_width = int(height * aspect[1])
+                left = (width - new_width) // 2
+                image = image.crop((left, 0, left + new_width, height))
+        image.thumbnail((spec['max_size'], spec['max_size']), Image.LANCZOS)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    @staticmethod
+    def derive_variants(media_id):
+        """Write every missing variant of an image; returns the names written"""
+        if not MediaStore.is_image(media_id):
+            return []
+        missing = [name for name in MEDIA_VARIANTS if not os.path.exists(MediaStore.variant_path(media_id, name))]
+        if not missing:
+            return []
+        try:
+            with Image.open(MediaStore.path(media_id)) as original:
+                original = ImageOps.exif_transpose(original)
+                for name in missing:
+                    spec = MEDIA_VARIANTS[name]
+                    variant = MediaStore._render_variant(original, spec)
+                    tmp_path = MediaStore.temp_path()
+                    try:
+                        variant.save(tmp_path, format=spec['format'], quality=spec['quality'], optimize=True)
+                        os.replace(tmp_path, MediaStore.variant_path(media_id, name))
+                    finally:
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return []  # not a decodable image; callers fall back to the original
+        return missing
+
+    @staticmethod
+    def extension(filename, content_type=None):
+        ext = os.path.splitext(filename or '')[1].lower()
+        if not _EXTENSION.match(ext):
+            ext = mimetypes.guess_extension(content_type or '') or ''
+        return ext if _EXTENSION.match(ext) else ''
+
+    @staticmethod
+    def temp_path():
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, MEDIA_TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    @staticmethod
+    def commit(tmp_path, digest, ext, size, content_type=None, ref=False):
+        """Move a fully written temp file into the store and register it"""
+        media_id = f"{digest}{ext}"
+        now = datetime.utcnow()
+        # Register before placing the file so a concurrent prune, which only
+        # removes objects untouched for MEDIA_PRUNE_GRACE, cannot race us
+        update = {
+            'set_on_insert__content_type': content_type or mimetypes.guess_type(f"x{ext}")[0],
+            'set_on_insert__size': size,
+            'set_on_insert__created_at': now,
+            'set__updated_at': now,
+        }
+        if ref:
+            update['inc__refcount'] = 1
+        else:
+            update['set_on_insert__refcount'] = 0
+        MediaObject.objects(id=media_id).update_one(upsert=True, **update)
+        final_path = MediaStore.path(media_id)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)  # identical bytes, so replacing is harmless
+        MediaStore.derive_variants(media_id)
+        return media_id
+
+    @staticmethod
+    def save_upload(uploaded_file, ref=True):
+        """Stream a Django upload into the store, hashing as it is written"""
+        sha = hashlib.sha256()
+        size = 0
+        tmp_path = MediaStore.temp_path()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in uploaded_file.chunks():
+                    sha.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            ext = MediaStore.extension(uploaded_file.name, uploaded_file.content_type)
+            return MediaStore.commit(tmp_path, sha.hexdigest(), ext, size, uploaded_file.content_type, ref=ref)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def save_bytes(data, ext, content_type=None, ref=False):
+        tmp_path = MediaStore.temp_path()
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            return MediaStore.commit(tmp_path, hashlib.sha256(data).hexdigest(), ext, len(data), content_type, ref=ref)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def acquire(media_id):
+        """Add a reference; returns False if the media does not exist"""
+        return bool(MediaObject.objects(id=media_id).update_one(
+            inc__refcount=1, set__updated_at=datetime.utcnow()
+        ))
+
+    @staticmethod
+    def release(media_id):
+        MediaObject.objects(id=media_id).update_one(dec__refcount=1, set__updated_at=datetime.utcnow())
+
+    @staticmethod
+    def prune(grace=MEDIA_PRUNE_GRACE):
+        """Delete unreferenced media that has not been touched within ``grace`` seconds"""
+        cutoff = datetime.utcnow() - timedelta(seconds=grace)
+        removed = 0
+        for media in MediaObject.objects(refcount__lte=0, updated_at__lt=cutoff).only('id'):
+            if MediaObject.objects(id=media.id, refcount__lte=0, updated_at__lt=cutoff).delete():
+                paths = [MediaStore.path(media.id)]
+                paths += [MediaStore.variant_path(media.id, name) for name in MEDIA_VARIANTS]
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def local_path(post, variant=None):
+        """Filesystem path of a post's image, or None
+
+        With ``variant`` (a platform or thumbnail name), the derived copy is
+        returned when the image has one, deriving it on first use for media
+        stored before the variant existed.
+        """
+        if post.media_id:
+            if variant and MediaStore.is_image(post.media_id):
+                path = MediaStore.variant_path(post.media_id, variant)
+                if os.path.exists(path) or MediaStore.derive_variants(post.media_id):
+                    return path
+            return MediaStore.path(post.media_id)
+        # Posts created before the media store kept only a /media/ URL
+        if post.image_path and post.image_path.startswith(settings.MEDIA_URL):
+            path = os.path.join(settings.MEDIA_ROOT, post.image_path[len(settings.MEDIA_URL):])
+            if os.path.exists(path):
+                return path
+        return None
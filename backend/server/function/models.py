@@ -1,4 +1,4 @@
-from mongoengine import Document, StringField, IntField, BooleanField, DateTimeField, ListField, ImageField, ReferenceField
+from mongoengine import Document, StringField, IntField, BooleanField, DateTimeField, ListField, ImageField, ReferenceField, DictField, FloatField
 from datetime import datetime
 import hashlib
 
@@ -6,6 +6,7 @@ class User(Document):
     username = StringField(max_length=100, required=True, unique=True)
     email = StringField(max_length=100, required=True)
     password_hash = StringField(required=True)
+    is_staff = BooleanField(default=False)  # operators: may see and reset every circuit breaker
     created_at = DateTimeField(default=datetime.utcnow)
     
     meta = {'collection': 'users'}
@@ -32,12 +33,16 @@ class SocialAccount(Document):
     is_active = BooleanField(default=True)
     created_at = DateTimeField(default=datetime.utcnow)
     
-    meta = {'collection': 'social_accounts'}
+    meta = {
+        'collection': 'social_accounts',
+        'indexes': [{'fields': ['user', 'platform'], 'unique': True}],
+    }
 
 class Post(Document):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
         ('scheduled', 'Scheduled'),
+        ('queued', 'Queued'),
         ('posted', 'Posted'),
         ('failed', 'Failed'),
     ]
@@ -46,14 +51,27 @@ class Post(Document):
     title = StringField(max_length=200, required=True)
     content = StringField(required=True)
     image_path = StringField()
+    media_id = StringField()
     generated_image_prompt = StringField()
     platforms = ListField(ReferenceField(SocialAccount))
     status = StringField(max_length=20, choices=STATUS_CHOICES, default='draft')
     scheduled_time = DateTimeField()
     created_at = DateTimeField(default=datetime.utcnow)
+    # Set whenever status or scheduled_time changes, so the scheduler picks
+    # up posts rescheduled inside the window it has already loaded
+    updated_at = DateTimeField(default=datetime.utcnow)
     posted_at = DateTimeField()
     
-    meta = {'collection': 'posts'}
+    meta = {
+        'collection': 'posts',
+        'indexes': [
+            ('user', '-created_at', '-id'),
+            ('user', 'status', '-created_at', '-id'),
+            ('status', 'scheduled_time'),
+            ('status', 'id'),
+            ('status', 'updated_at'),
+        ],
+    }
 
 class PostResult(Document):
     post = ReferenceField(Post, required=True)
@@ -62,4 +80,148 @@ class PostResult(Document):
     error_message = StringField()
     posted_at = DateTimeField(default=datetime.utcnow)
     
-    meta = {'collection': 'post_results'}
\ No newline at end of file
+    meta = {
+        'collection': 'post_results',
+        'indexes': [('post', 'posted_at')],
+    }
+
+class PublishStats(Document):
+    user = ReferenceField(User, required=True)
+    platform = StringField(max_length=20, required=True)
+    day = DateTimeField(required=True)
+    attempts = IntField(default=0)
+    successes = IntField(default=0)
+    failures = IntField(default=0)
+    failure_reasons = DictField()  # reason -> count, see function.analytics
+    
+    meta = {
+        'collection': 'publish_stats',
+        'indexes': [{'fields': ['user', 'day', 'platform'], 'unique': True}],
+    }
+
+class PublishJob(Document):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    post = ReferenceField(Post, required=True)
+    user = ReferenceField(User, required=True)
+    publish_data = DictField()
+    status = StringField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    results = ListField(DictField())
+    error_message = StringField()
+    attempts = IntField(default=0)
+    dedupe_key = StringField()
+    worker_id = StringField()
+    lease_expires_at = DateTimeField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    started_at = DateTimeField()
+    finished_at = DateTimeField()
+    
+    meta = {
+        'collection': 'publish_jobs',
+        'indexes': [
+            ('status', 'created_at'),
+            ('status', 'lease_expires_at'),
+            {'fields': ['dedupe_key'], 'unique': True, 'sparse': True},
+        ],
+    }
+
+class UserSession(Document):
+    id = StringField(primary_key=True)  # sha256 of the token, never the token itself
+    user = ReferenceField(User, required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    expires_at = DateTimeField(required=True)
+    
+    meta = {
+        'collection': 'user_sessions',
+        'indexes': [
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0},
+            'user',
+        ],
+    }
+
+class RateLimit(Document):
+    id = StringField(primary_key=True)  # platform and hashed key, see function.ratelimit
+    tat = FloatField()  # theoretical arrival time of the next call, as a Unix timestamp
+    
+    meta = {'collection': 'rate_limits'}
+
+class InstagramSession(Document):
+    user = ReferenceField(User, required=True)  # the app user who logged in
+    username = StringField(max_length=100, required=True)
+    settings = DictField()
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'instagram_user_sessions',
+        'indexes': [{'fields': ['user', 'username'], 'unique': True}, ('user', '-updated_at')],
+    }
+
+class TelegramFile(Document):
+    key = StringField(required=True, unique=True)  # bot token hash + content sha256
+    file_id = StringField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {'collection': 'telegram_files'}
+
+class MediaObject(Document):
+    # Content-addressed: the id is "<sha256><ext>" and the file lives at a
+    # path derived from it, see function.media.MediaStore
+    id = StringField(primary_key=True)
+    content_type = StringField()
+    size = IntField()
+    refcount = IntField(default=0)
+    created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'media_objects',
+        'indexes': [('refcount', 'updated_at')],
+    }
+
+class GenerationJob(Document):
+    STATUS_CHOICES = PublishJob.STATUS_CHOICES
+    
+    user = ReferenceField(User, required=True)
+    batch_id = StringField(required=True)
+    prompt = StringField(required=True)
+    params = DictField()
+    status = StringField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    media_id = StringField()
+    error_message = StringField()
+    attempts = IntField(default=0)
+    worker_id = StringField()
+    lease_expires_at = DateTimeField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    started_at = DateTimeField()
+    finished_at = DateTimeField()
+    
+    meta = {
+        'collection': 'generation_jobs',
+        'indexes': [
+            ('status', 'created_at'),
+            ('status', 'lease_expires_at'),
+            ('user', 'batch_id'),
+        ],
+    }
+
+class UploadSession(Document):
+    id = StringField(primary_key=True)
+    user = ReferenceField(User, required=True)
+    filename = StringField(max_length=255)
+    content_type = StringField(max_length=100, required=True)
+    size = IntField(required=True)
+    offset = IntField(default=0)
+    status = StringField(max_length=20, choices=[('open', 'Open'), ('complete', 'Complete')], default='open')
+    media_id = StringField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'upload_sessions',
+        'indexes': [('status', 'updated_at')],
+    }
@@ -0,0 +1,50 @@
+import os
+import json
+import base64
+from datetime import datetime
+from bson import ObjectId
+from mongoengine.queryset.visitor import Q
+
+# Listings are paged by (created_at, _id) instead of skip/limit, so fetching a
+# page is an index seek plus ``limit`` documents however deep the client is
+POSTS_PAGE_SIZE = int(os.getenv("POSTS_PAGE_SIZE", "20"))
+POSTS_MAX_PAGE_SIZE = int(os.getenv("POSTS_MAX_PAGE_SIZE", "100"))
+
+class KeysetPaginator:
+    """Newest-first pages over a queryset ordered by (-created_at, -id)"""
+
+    @staticmethod
+    def encode(doc):
+        payload = json.dumps([doc.created_at.isoformat(), str(doc.id)])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode(cursor):
+        """(created_at, ObjectId) from a cursor; raises ValueError if malformed"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return datetime.fromisoformat(created_at), ObjectId(doc_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def page_size(value):
+        if value in (None, ''):
+            return POSTS_PAGE_SIZE
+        size = int(value)
+        if size < 1:
+            raise ValueError("limit must be positive")
+        return min(size, POSTS_MAX_PAGE_SIZE)
+
+    @staticmethod
+    def paginate(queryset, cursor=None, limit=POSTS_PAGE_SIZE):
+        """Return (documents, next_cursor); next_cursor is None on the last page"""
+        if cursor:
+            created_at, doc_id = KeysetPaginator.decode(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=doc_id))
+        # One extra document tells us whether another page exists
+        docs = list(queryset.order_by('-created_at', '-id').limit(limit + 1))
+        if len(docs) > limit:
+            return docs[:limit], KeysetPaginator.encode(docs[limit - 1])
+        return docs, None
@@ -0,0 +1,240 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import httpx
+from pymongo import ReturnDocument
+from .clients import get_motor_db
+from .models import RateLimit
+
+# Documented platform limits; override per deployment if an app has been
+# granted a higher tier.
+#   Telegram: ~30 messages/second per bot, 20 messages/minute per group or channel
+#   Graph API (pages): 200 calls/hour per user token
+#   WhatsApp Cloud API: 80 messages/second per business phone number
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_CHAT_RATE_PER_MINUTE", "20"))
+FACEBOOK_RATE_PER_HOUR = float(os.getenv("FACEBOOK_RATE_PER_HOUR", "200"))
+FACEBOOK_BURST = int(os.getenv("FACEBOOK_BURST", "20"))
+WHATSAPP_RATE = float(os.getenv("WHATSAPP_RATE", "80"))
+
+# The limits apply to the bot, token or number, not to one process, so by
+# default every web and worker process draws from buckets kept in MongoDB.
+# "memory" keeps per-process buckets, which is only right for a single process.
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "mongo")
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Graph API reports throttling in the error body, often with a 400/403 status
+GRAPH_THROTTLE_CODES = {4, 17, 32, 613, 80001, 80004, 130429, 131048, 131056}
+
+class RetryableError(Exception):
+    """A transient failure worth retrying, optionally after a server-given delay"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Thread-safe token bucket that hands out reservations
+
+    reserve() always takes a token and returns how long the caller must wait
+    before using it, so sync and async callers can share one bucket.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        """Give back a reserved token that was never used"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds):
+        """Hold every caller back for at least ``seconds`` (e.g. after a 429)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    async def areserve(self):
+        return self.reserve()
+
+    async def arefund(self):
+        self.refund()
+
+    async def apause(self, seconds):
+        self.pause(seconds)
+
+class SharedTokenBucket:
+    """The same bucket kept in MongoDB, so every process shares one limit
+
+    Stored as a theoretical arrival time (GCRA): each reservation pushes
+    ``tat`` out by one interval, and a caller waits until ``tat`` is no more
+    than ``capacity`` intervals ahead of now. Hosts need synchronised clocks.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.interval = 1.0 / rate
+        self.capacity = capacity
+
+    @staticmethod
+    def _collection():
+        return get_motor_db()[RateLimit._get_collection_name()]
+
+    async def areserve(self):
+        now = time.time()
+        doc = await self._collection().find_one_and_update(
+            {'_id': self.name},
+            [{'$set': {'tat': {'$add': [{'$max': [{'$ifNull': ['$tat', now]}, now]}, self.interval]}}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return max(0.0, doc['tat'] - self.capacity * self.interval - now)
+
+    async def arefund(self):
+        await self._collection().update_one({'_id': self.name}, {'$inc': {'tat': -self.interval}})
+
+    async def apause(self, seconds):
+        held = time.time() + seconds + (self.capacity - 1) * self.interval
+        await self._collection().update_one({'_id': self.name}, {'$max': {'tat': held}}, upsert=True)
+
+class RateLimiter:
+    _buckets = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def bucket(platform, key, rate, capacity):
+        name = (platform, hashlib.sha256(str(key).encode()).hexdigest()[:16])
+        bucket = RateLimiter._buckets.get(name)
+        if bucket is None:
+            if RATE_LIMIT_STORE == 'mongo':
+                bucket = SharedTokenBucket(':'.join(name), rate, capacity)
+            else:
+                bucket = TokenBucket(rate, capacity)
+            with RateLimiter._lock:
+                bucket = RateLimiter._buckets.setdefault(name, bucket)
+        return bucket
+
+    @staticmethod
+    def telegram(token, chat_id):
+        return [
+            RateLimiter.bucket('telegram', token, TELEGRAM_GLOBAL_RATE, max(1, int(TELEGRAM_GLOBAL_RATE))),
+            RateLimiter.bucket('telegram-chat', f"{token}:{chat_id}", TELEGRAM_CHAT_RATE_PER_MINUTE / 60, 1),
+        ]
+
+    @staticmethod
+    def facebook(access_token):
+        return [RateLimiter.bucket('facebook', access_token, FACEBOOK_RATE_PER_HOUR / 3600, FACEBOOK_BURST)]
+
+    @staticmethod
+    def whatsapp(phone_number_id):
+        return [RateLimiter.bucket('whatsapp', phone_number_id, WHATSAPP_RATE, max(1, int(WHATSAPP_RATE)))]
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff; a server-given delay always wins"""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+def check_graph_response(response):
+    """Raise RetryableError for throttled or transient Graph API responses"""
+    retryable = response.status_code in RETRY_STATUS_CODES
+    if not retryable and response.status_code >= 400:
+        try:
+            code = response.json().get('error', {}).get('code')
+        except ValueError:
+            code = None
+        retryable = code in GRAPH_THROTTLE_CODES
+    if retryable:
+        raise RetryableError(response.text, parse_retry_after(response.headers.get('Retry-After')))
+    return response
+
+async def apost_with_retry(client, url, **kwargs):
+    """Graph API POST on an httpx.AsyncClient that turns transient failures into RetryableError"""
+    try:
+        response = await client.post(url, **kwargs)
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        # Read timeouts are different: the post may already exist, so they
+        # propagate unretried
+        raise RetryableError(str(e))
+    return check_graph_response(response)
+
+async def _retry_delay(error, attempt, buckets):
+    if error.retry_after is not None and buckets:
+        # Paused buckets make the next reservation wait out Retry-After for
+        # every caller sharing them
+        for bucket in buckets:
+            await bucket.apause(error.retry_after)
+        return random.uniform(0, RETRY_BASE_DELAY)
+    return backoff_delay(attempt, error.retry_after)
+
+async def acquire(buckets):
+    """Wait for a token from every bucket
+
+    If the caller is cancelled while waiting (e.g. by a publish timeout) the
+    tokens are handed back, so abandoned waits do not pile up as bucket debt.
+    """
+    reserved = []
+    try:
+        for bucket in buckets:
+            wait = await bucket.areserve()
+            reserved.append(bucket)
+            await asyncio.sleep(wait)
+    except asyncio.CancelledError:
+        for bucket in reserved:
+            try:
+                await bucket.arefund()
+            except Exception:
+                pass
+        raise
+
+async def acall_with_retry(func, buckets, prepaid=False):
+    """Call ``func`` (which returns an awaitable) under the given rate limits, retrying RetryableError
+
+    ``prepaid`` means the caller already acquired the first attempt's tokens.
+    """
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        if attempt or not prepaid:
+            await acquire(buckets)
+        try:
+            return await func()
+        except RetryableError as e:
+            if attempt == RETRY_MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(await _retry_delay(e, attempt, buckets))
@@ -0,0 +1,141 @@
+import heapq
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from .models import Post, PublishJob, SocialAccount
+
+# Posts due within the lookahead window are kept in memory; anything later is
+# picked up as the window slides forward.
+SCHEDULER_LOOKAHEAD = int(os.getenv("SCHEDULER_LOOKAHEAD", "300"))
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+# Posts updated this long before the last refresh are read again, to allow
+# for clock skew between the app servers and the scheduler
+SCHEDULER_UPDATE_SLACK = int(os.getenv("SCHEDULER_UPDATE_SLACK", "30"))
+
+DUPLICATE_KEY = 11000
+
+class PostScheduler:
+    """Fires scheduled posts into the publish job queue
+
+    Due posts live in a min-heap ordered by scheduled_time. Each refresh only
+    reads the slice of the (status, scheduled_time) index that entered the
+    lookahead window since the last refresh, plus posts created or updated
+    since then.
+    Firing is idempotent across instances: every job carries a dedupe key on a
+    unique index, so only one scheduler can queue a given post.
+    """
+
+    def __init__(self, lookahead=SCHEDULER_LOOKAHEAD, batch_size=SCHEDULER_BATCH_SIZE, update_slack=SCHEDULER_UPDATE_SLACK):
+        self.lookahead = timedelta(seconds=lookahead)
+        self.batch_size = batch_size
+        self.update_slack = timedelta(seconds=update_slack)
+        self.heap = []
+        self.scheduled = {}  # post id -> scheduled_time currently in the heap
+        self.loaded_until = None
+        self.last_id = None
+        self.refreshed_at = None
+
+    def refresh(self, now=None):
+        """Load posts that became due within the window; returns how many were added"""
+        now = now or datetime.utcnow()
+        horizon = now + self.lookahead
+        query = {'status': 'scheduled', 'scheduled_time': {'$lte': horizon}}
+        if self.loaded_until is not None:
+            query['$or'] = [
+                {'scheduled_time': {'$gt': self.loaded_until}},
+                {'_id': {'$gt': self.last_id}},
+                {'updated_at': {'$gte': self.refreshed_at - self.update_slack}},
+            ]
+
+        added = 0
+        cursor = Post._get_collection().find(query, {'scheduled_time': 1}).sort('scheduled_time', 1)
+        for doc in cursor:
+            if self.last_id is None or doc['_id'] > self.last_id:
+                self.last_id = doc['_id']
+            if self.scheduled.get(doc['_id']) != doc['scheduled_time']:
+                self.scheduled[doc['_id']] = doc['scheduled_time']
+                heapq.heappush(self.heap, (doc['scheduled_time'], doc['_id']))
+                added += 1
+
+        self.loaded_until = horizon
+        self.refreshed_at = now
+        if self.last_id is None:
+            self.last_id = ObjectId.from_datetime(now)
+        return added
+
+    def resync(self):
+        """Drop the in-memory window and reload it from the index"""
+        self.heap = []
+        self.scheduled = {}
+        self.loaded_until = None
+        self.last_id = None
+        self.refreshed_at = None
+        return self.refresh()
+
+    def pop_due(self, now=None):
+        """Pop up to batch_size post ids whose scheduled_time has passed"""
+        now = now or datetime.utcnow()
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch_size:
+            scheduled_time, post_id = heapq.heappop(self.heap)
+            # Stale entry left behind by a reschedule
+            if self.scheduled.get(post_id) != scheduled_time:
+                continue
+            del self.scheduled[post_id]
+            due.append(post_id)
+        return due
+
+    def seconds_until_next(self, now=None):
+        if not self.heap:
+            return None
+        now = now or datetime.utcnow()
+        return max(0.0, (self.heap[0][0] - now).total_seconds())
+
+    def fire(self, post_ids, now=None):
+        """Queue publish jobs for due posts; returns the ids this instance queued"""
+        if not post_ids:
+            return []
+        now = now or datetime.utcnow()
+
+        posts = list(Post._get_collection().find(
+            {'_id': {'$in': post_ids}, 'status': 'scheduled', 'scheduled_time': {'$lte': now}},
+            {'user': 1, 'platforms': 1, 'scheduled_time': 1},
+        ))
+        if not posts:
+            return []
+
+        account_ids = {account_id for post in posts for account_id in post.get('platforms', [])}
+        platform_names = {}
+        if account_ids:
+            for account in SocialAccount._get_collection().find({'_id': {'$in': list(account_ids)}}, {'platform': 1}):
+                platform_names[account['_id']] = account['platform']
+
+        jobs = []
+        for post in posts:
+            platforms = {platform_names[a]: True for a in post.get('platforms', []) if a in platform_names}
+            job = PublishJob(
+                post=post['_id'],
+                user=post['user'],
+                publish_data={'platforms': platforms, 'credentials': {}},
+                dedupe_key=f"schedule:{post['_id']}:{post['scheduled_time'].isoformat()}",
+                created_at=now,
+            )
+            jobs.append(job.to_mongo().to_dict())
+
+        queued = {job['post'] for job in jobs}
+        try:
+            PublishJob._get_collection().insert_many(jobs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != DUPLICATE_KEY:
+                    raise
+                # Another scheduler instance already queued this post
+                queued.discard(jobs[error['index']]['post'])
+
+        if queued:
+            Post._get_collection().update_many(
+                {'_id': {'$in': list(queued)}, 'status': 'scheduled'},
+                {'$set': {'status': 'queued'}},
+            )
+        return list(queued)
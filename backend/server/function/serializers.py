@@ -1,5 +1,7 @@
+from mongoengine import Document
 from rest_framework import serializers
-from .models import Post, SocialAccount, PostResult, User
+from .media import MediaStore
+from .models import SocialAccount
 
 class UserSerializer(serializers.Serializer):
     id = serializers.CharField(read_only=True)
@@ -13,11 +15,60 @@ class SocialAccountSerializer(serializers.Serializer):
     is_active = serializers.BooleanField(default=True)
     created_at = serializers.DateTimeField(read_only=True)
 
+ACCOUNT_SUMMARY_FIELDS = ('platform', 'username', 'is_active', 'created_at')
+
+def reference_id(ref):
+    """ObjectId of a loaded document, DBRef or raw ObjectId"""
+    return getattr(ref, 'id', ref)
+
+def load_accounts(refs):
+    """Serialized social accounts keyed by id, fetching unloaded references in one query
+
+    ``refs`` may mix loaded SocialAccount documents with the raw ObjectIds or
+    DBRefs of a queryset read with ``no_dereference()``.
+    """
+    accounts, missing = {}, set()
+    for ref in refs:
+        if isinstance(ref, Document):
+            accounts[ref.id] = SocialAccountSerializer(ref).data
+        else:
+            missing.add(reference_id(ref))
+    missing -= accounts.keys()
+    if missing:
+        rows = SocialAccount.objects(id__in=list(missing)).only(*ACCOUNT_SUMMARY_FIELDS).as_pymongo()
+        for row in rows:
+            accounts[row['_id']] = SocialAccountSerializer({**row, 'id': str(row['_id'])}).data
+    return accounts
+
+class PreloadAccountsListSerializer(serializers.ListSerializer):
+    """Resolves every account referenced on the page with one $in before serializing"""
+    account_field = None
+    
+    def to_representation(self, data):
+        items = list(data)
+        refs = []
+        for item in items:
+            value = getattr(item, self.account_field, None)
+            refs.extend(value if isinstance(value, list) else [value] if value else [])
+        self.context['accounts'] = load_accounts(refs)
+        return super().to_representation(items)
+
+class PostListSerializer(PreloadAccountsListSerializer):
+    account_field = 'platforms'
+
+class PostResultListSerializer(PreloadAccountsListSerializer):
+    account_field = 'platform'
+
+# Fields left out of post listings requested with ?fields=summary
+POST_SUMMARY_EXCLUDE = ('content', 'generated_image_prompt')
+
 class PostSerializer(serializers.Serializer):
     id = serializers.CharField(read_only=True)
     title = serializers.CharField()
     content = serializers.CharField()
     image_path = serializers.CharField(required=False, allow_blank=True)
+    media_id = serializers.CharField(read_only=True)
+    thumbnail_url = serializers.SerializerMethodField()
     generated_image_prompt = serializers.CharField(required=False, allow_blank=True)
     status = serializers.CharField(default='draft')
     scheduled_time = serializers.DateTimeField(required=False, allow_null=True)
@@ -25,10 +76,26 @@ class PostSerializer(serializers.Serializer):
     posted_at = serializers.DateTimeField(read_only=True)
     platforms = serializers.SerializerMethodField()
     
+    def __init__(self, *args, exclude=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in exclude:
+            self.fields.pop(name, None)
+    
+    def get_thumbnail_url(self, obj):
+        if obj.media_id and MediaStore.is_image(obj.media_id):
+            return MediaStore.variant_url(obj.media_id, 'thumb')
+        return obj.image_path or None
+    
     def get_platforms(self, obj):
-        if hasattr(obj, 'platforms') and obj.platforms:
-            return [SocialAccountSerializer(platform).data for platform in obj.platforms]
-        return []
+        if not getattr(obj, 'platforms', None):
+            return []
+        accounts = self.context.get('accounts')
+        if accounts is None:
+            accounts = load_accounts(obj.platforms)
+        return [accounts[reference_id(ref)] for ref in obj.platforms if reference_id(ref) in accounts]
+    
+    class Meta:
+        list_serializer_class = PostListSerializer
 
 class PostResultSerializer(serializers.Serializer):
     id = serializers.CharField(read_only=True)
@@ -38,6 +105,55 @@ class PostResultSerializer(serializers.Serializer):
     platform = serializers.SerializerMethodField()
     
     def get_platform(self, obj):
-        if hasattr(obj, 'platform') and obj.platform:
-            return SocialAccountSerializer(obj.platform).data
-        return None
\ No newline at end of file
+        if not getattr(obj, 'platform', None):
+            return None
+        accounts = self.context.get('accounts')
+        if accounts is None:
+            accounts = load_accounts([obj.platform])
+        return accounts.get(reference_id(obj.platform))
+    
+    class Meta:
+        list_serializer_class = PostResultListSerializer
+
+class PublishJobSerializer(serializers.Serializer):
+    id = serializers.CharField(read_only=True)
+    post_id = serializers.SerializerMethodField()
+    status = serializers.CharField()
+    results = serializers.ListField(child=serializers.DictField())
+    error_message = serializers.CharField()
+    attempts = serializers.IntegerField()
+    created_at = serializers.DateTimeField()
+    started_at = serializers.DateTimeField()
+    finished_at = serializers.DateTimeField()
+    
+    def get_post_id(self, obj):
+        return str(obj.to_mongo()['post'])
+
+class GenerationJobSerializer(serializers.Serializer):
+    id = serializers.CharField(read_only=True)
+    batch_id = serializers.CharField()
+    prompt = serializers.CharField()
+    status = serializers.CharField()
+    media_id = serializers.CharField()
+    url = serializers.SerializerMethodField()
+    error_message = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    finished_at = serializers.DateTimeField()
+    
+    def get_url(self, obj):
+        return MediaStore.url(obj.media_id) if obj.media_id else None
+
+
+class UploadSessionSerializer(serializers.Serializer):
+    id = serializers.CharField(read_only=True)
+    filename = serializers.CharField()
+    content_type = serializers.CharField()
+    size = serializers.IntegerField()
+    offset = serializers.IntegerField()
+    status = serializers.CharField()
+    media_id = serializers.CharField()
+    url = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField()
+    
+    def get_url(self, obj):
+        return MediaStore.url(obj.media_id) if obj.media_id else None
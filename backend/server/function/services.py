@@ -1,49 +1,77 @@
 import os
 import base64
-import requests
 import asyncio
-from telegram import Bot
-from instagrapi import Client
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+import httpx
+from instagrapi.exceptions import ClientConnectionError, ClientThrottledError, PleaseWaitFewMinutes
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
 from dotenv import load_dotenv
-from .models import Post, PostResult, SocialAccount
+from .models import Post, PostResult, PublishStats, SocialAccount
+from .analytics import PublishAnalytics
+from .clients import HttpClients, get_graph_client, get_motor_db, get_telegram_bot
+from .breaker import CircuitBreakers
+from .instagram import InstagramSessionStore
+from .telegram_files import TelegramFileCache
+from .media import MediaStore
+from .image_cache import prompt_image_cache
+from .ratelimit import RateLimiter, RetryableError, acall_with_retry, acquire, apost_with_retry
 
 # Load .env from project root
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '..', '..', '.env'))
 
+STABILITY_ENGINE = "stable-diffusion-v1-6"
+
+# Failures that say the platform is unhealthy rather than that the post or the
+# configuration is wrong; the platform services let these propagate so only
+# they count against the circuit breakers
+TRANSIENT_ERRORS = (RetryableError, TimedOut, httpx.TransportError, ConnectionError,
+                    ClientConnectionError, ClientThrottledError, PleaseWaitFewMinutes)
+
 class ImageGenerator:
     @staticmethod
-    def generate_image(prompt):
-        """Generate image using Stability AI"""
+    def generate_image_bytes(prompt, cfg_scale=7, height=512, width=512, steps=30):
+        """Generate a PNG with Stability AI, reusing cached results for repeated prompts"""
+        params = {'engine': STABILITY_ENGINE, 'cfg_scale': cfg_scale, 'height': height, 'width': width, 'steps': steps}
+        key = prompt_image_cache.key(prompt, **params)
+        return prompt_image_cache.get_or_generate(
+            key, lambda: ImageGenerator.request_image(prompt, cfg_scale, height, width, steps)
+        )
+    
+    @staticmethod
+    def request_image(prompt, cfg_scale, height, width, steps):
         api_key = os.getenv("STABILITY_API_KEY")
         if not api_key:
             raise Exception("STABILITY_API_KEY not found in environment")
         
-        url = "https://api.stability.ai/v1/generation/stable-diffusion-v1-6/text-to-image"
+        url = f"https://api.stability.ai/v1/generation/{STABILITY_ENGINE}/text-to-image"
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
-            "Accept": "application/json"
+            "Accept": "image/png"
         }
         
         payload = {
             "text_prompts": [{"text": prompt}],
-            "cfg_scale": 7,
-            "height": 512,
-            "width": 512,
+            "cfg_scale": cfg_scale,
+            "height": height,
+            "width": width,
             "samples": 1,
-            "steps": 30
+            "steps": steps
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = HttpClients.stability().post(url, headers=headers, json=payload)
         if response.status_code == 200:
-            data = response.json()
-            return data['artifacts'][0]['base64']
+            return response.content
         else:
             raise Exception(f"Image generation failed: {response.text}")
 
 class TelegramService:
     @staticmethod
-    async def post_to_telegram(post, account):
+    async def post_to_telegram(post, account, prepaid=False):
         """Post to Telegram channel"""
         try:
             token = os.getenv("TELEGRAM_TOKEN")
@@ -52,73 +80,90 @@ class TelegramService:
             if not token or not chat_id:
                 return False, "Telegram credentials not configured"
             
-            bot = Bot(token=token)
+            bot = get_telegram_bot(token)
             caption = f"{post.title}\n\n{post.content}"
             
-            # Send message
-            if post.image_path:
-                # Try to find image
-                possible_paths = [
-                    post.image_path,
-                    post.image_path.replace('/media/', 'media/'),
-                    os.path.join('media', post.image_path.replace('/media/', ''))
-                ]
-                
-                image_found = False
-                for path in possible_paths:
-                    if os.path.exists(path):
-                        with open(path, "rb") as photo:
-                            await bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
-                        image_found = True
-                        break
-                
-                if not image_found:
-                    await bot.send_message(chat_id=chat_id, text=caption)
-            else:
-                await bot.send_message(chat_id=chat_id, text=caption)
+            photo_path = await run_blocking(MediaStore.local_path, post, 'telegram')
+            
+            # Reuse the file_id of an earlier upload of the same image
+            digest = file_id = None
+            if photo_path:
+                if post.media_id:
+                    # Stored files are named after their content
+                    digest = os.path.basename(photo_path)
+                else:
+                    digest = await run_blocking(TelegramFileCache.file_digest, photo_path)
+                file_id = await TelegramFileCache.aget(token, digest)
+            
+            async def send():
+                nonlocal file_id
+                try:
+                    if file_id:
+                        try:
+                            return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+                        except BadRequest:
+                            await TelegramFileCache.aforget(token, digest)
+                            file_id = None
+                    if photo_path:
+                        with open(photo_path, "rb") as photo:
+                            message = await bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+                        await TelegramFileCache.aput(token, digest, message.photo[-1].file_id)
+                        return message
+                    return await bot.send_message(chat_id=chat_id, text=caption)
+                except RetryAfter as e:
+                    raise RetryableError(str(e), retry_after=e.retry_after)
+                except BadRequest:
+                    raise
+                except TimedOut:
+                    raise  # may have been delivered; never resend
+                except NetworkError as e:
+                    raise RetryableError(str(e))
+            
+            await acall_with_retry(send, RateLimiter.telegram(token, chat_id), prepaid=prepaid)
             
             return True, "Posted to Telegram successfully"
             
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             return False, f"Telegram error: {str(e)}"
 
 class InstagramService:
     @staticmethod
-    def post_to_instagram(post, account, username, password):
-        """Post to Instagram using instagrapi"""
+    def post_to_instagram(post, account, owner, username, password):
+        """Post to Instagram using the owner's cached instagrapi session"""
         try:
-            from instagrapi import Client
+            username = username or InstagramSessionStore.default_username(owner)
+            if not username:
+                return False, "Instagram username is required"
             
-            if not post.image_path:
+            image_path = MediaStore.local_path(post, 'instagram')
+            if not image_path:
                 return False, "Instagram requires an image"
             
-            # Find image file
-            image_path = post.image_path.replace('/media/', 'media/')
-            if not os.path.exists(image_path):
-                return False, f"Image file not found: {image_path}"
-            
-            cl = Client()
-            cl.delay_range = [2, 8]
-            
-            # Login
-            if not cl.login(username, password):
-                return False, "Instagram login failed"
-            
             # Upload photo
             caption = f"{post.title}\n\n{post.content}"
-            media = cl.photo_upload(image_path, caption=caption)
+            media = InstagramSessionStore.run(
+                owner, username, password, lambda cl: cl.photo_upload(image_path, caption=caption)
+            )
             
             if media:
                 return True, f"Posted to Instagram successfully (ID: {media.pk})"
             else:
                 return False, "Failed to upload to Instagram"
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             return False, f"Instagram error: {str(e)}"
 
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
 class FacebookService:
     @staticmethod
-    def post_to_facebook(post, account):
+    async def post_to_facebook(post, account, prepaid=False):
         """Post to Facebook page"""
         try:
             page_id = os.getenv("FB_PAGE_ID")
@@ -128,38 +173,36 @@ class FacebookService:
                 return False, "Facebook credentials not configured"
             
             message = f"{post.title}\n\n{post.content}"
+            post_url = f"https://graph.facebook.com/{page_id}/feed"
+            payload = {
+                "access_token": access_token,
+                "message": message
+            }
             
-            if post.image_path and os.path.exists(post.image_path.replace('/media/', 'media/')):
+            image_path = await run_blocking(MediaStore.local_path, post, 'facebook')
+            files = None
+            if image_path:
                 # Post with image
-                post_url = f"https://graph.facebook.com/{page_id}/feed"
-                payload = {
-                    "access_token": access_token,
-                    "message": message
-                }
-                image_path = post.image_path.replace('/media/', 'media/')
-                with open(image_path, "rb") as img:
-                    files = {"source": img}
-                    response = requests.post(post_url, data=payload, files=files)
-            else:
-                # Text only
-                post_url = f"https://graph.facebook.com/{page_id}/feed"
-                payload = {
-                    "access_token": access_token,
-                    "message": message
-                }
-                response = requests.post(post_url, data=payload)
+                files = {"source": (os.path.basename(image_path), await run_blocking(read_file, image_path))}
+            
+            response = await acall_with_retry(
+                lambda: apost_with_retry(get_graph_client(), post_url, data=payload, files=files),
+                RateLimiter.facebook(access_token), prepaid=prepaid
+            )
             
             if response.status_code == 200:
                 return True, "Posted to Facebook successfully"
             else:
                 return False, f"Facebook error: {response.text}"
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             return False, f"Facebook error: {str(e)}"
 
 class WhatsAppService:
     @staticmethod
-    def post_to_whatsapp(post, account):
+    async def post_to_whatsapp(post, account, prepaid=False):
         """Post to WhatsApp using Cloud API"""
         try:
             access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
@@ -185,106 +228,253 @@ class WhatsAppService:
                 }
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = await acall_with_retry(
+                lambda: apost_with_retry(get_graph_client(), url, headers=headers, json=payload),
+                RateLimiter.whatsapp(phone_number_id), prepaid=prepaid
+            )
             
             if response.status_code == 200:
                 return True, "Posted to WhatsApp successfully"
             else:
                 return False, f"WhatsApp error: {response.text}"
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             return False, f"WhatsApp error: {str(e)}"
 
+# Selected platforms are published concurrently. Telegram and the Graph API are
+# called natively async; blocking work (image variants, MongoDB writes) runs on
+# a bounded thread pool so it never stalls the event loop. instagrapi uploads
+# hold a thread for minutes, so they get a pool of their own and cannot starve
+# everything else.
+PUBLISH_MAX_WORKERS = int(os.getenv("PUBLISH_MAX_WORKERS", "8"))
+INSTAGRAM_MAX_WORKERS = int(os.getenv("INSTAGRAM_MAX_WORKERS", "4"))
+PUBLISH_PLATFORM_TIMEOUT = float(os.getenv("PUBLISH_PLATFORM_TIMEOUT", "30"))
+# instagrapi sleeps 2-8s between requests, so a login plus upload needs longer.
+# The upload thread cannot be cancelled, so a timeout leaves the outcome unknown.
+INSTAGRAM_PUBLISH_TIMEOUT = float(os.getenv("INSTAGRAM_PUBLISH_TIMEOUT", "180"))
+
+_publish_executor = ThreadPoolExecutor(max_workers=PUBLISH_MAX_WORKERS, thread_name_prefix="publish")
+_instagram_executor = ThreadPoolExecutor(max_workers=INSTAGRAM_MAX_WORKERS, thread_name_prefix="instagram")
+
+PLATFORM_LABELS = {
+    'telegram': 'Telegram',
+    'instagram': 'Instagram',
+    'facebook': 'Facebook',
+    'whatsapp': 'WhatsApp',
+}
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the shared publish executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_publish_executor, functools.partial(func, *args, **kwargs))
+
+async def run_instagram(func, *args, **kwargs):
+    """Run a blocking instagrapi call on the Instagram executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_instagram_executor, functools.partial(func, *args, **kwargs))
+
 class PostingService:
     
     @staticmethod
-    async def publish_post(post_id, publish_data=None):
-        """Publish post to selected platforms"""
+    def account_upserts(user_id, platforms):
+        """Create-if-missing writes; the unique (user, platform) index makes racing publishes share one account"""
+        now = datetime.utcnow()
+        return [
+            UpdateOne(
+                {'user': user_id, 'platform': platform},
+                {'$setOnInsert': {'username': PLATFORM_LABELS[platform], 'is_active': True, 'created_at': now}},
+                upsert=True,
+            )
+            for platform in platforms
+        ]
+    
+    @staticmethod
+    def get_accounts(user, platforms):
+        """Map each platform to the user's account, creating missing ones in bulk"""
+        accounts = {}
+        if not platforms:
+            return accounts
+        for account in SocialAccount.objects(user=user, platform__in=platforms):
+            accounts[account.platform] = account
+        
+        missing = [platform for platform in platforms if platform not in accounts]
+        if missing:
+            SocialAccount._get_collection().bulk_write(PostingService.account_upserts(user.id, missing), ordered=False)
+            for account in SocialAccount.objects(user=user, platform__in=missing):
+                accounts[account.platform] = account
+        return accounts
+    
+    @staticmethod
+    async def aget_accounts(user_id, platforms):
+        """get_accounts over motor, for the async publish path"""
+        accounts = {}
+        if not platforms:
+            return accounts
+        collection = get_motor_db()[SocialAccount._get_collection_name()]
+        async for doc in collection.find({'user': user_id, 'platform': {'$in': platforms}}):
+            accounts[doc['platform']] = SocialAccount._from_son(doc)
+        
+        missing = [platform for platform in platforms if platform not in accounts]
+        if missing:
+            await collection.bulk_write(PostingService.account_upserts(user_id, missing), ordered=False)
+            async for doc in collection.find({'user': user_id, 'platform': {'$in': missing}}):
+                accounts[doc['platform']] = SocialAccount._from_son(doc)
+        return accounts
+    
+    @staticmethod
+    async def save_results(post, accounts, results, user_id):
+        """Write every platform result, the user's analytics rollups and the post's new status"""
+        db = get_motor_db()
+        now = datetime.utcnow()
+        saved = [r for r in results if r['platform'] in accounts]
+        rows = [
+            PostResult(post=post.id, platform=accounts[r['platform']].id, success=r['success'],
+                       error_message=r['message'] if not r['success'] else "", posted_at=now).to_mongo()
+            for r in saved
+        ]
         try:
-            post = Post.objects.get(id=post_id)
-            results = []
+            if rows:
+                await db[PostResult._get_collection_name()].insert_many(rows, ordered=False)
+        except Exception:
+            pass  # Don't fail if result save fails
+        
+        try:
+            if saved:
+                await db[PublishStats._get_collection_name()].bulk_write(
+                    PublishAnalytics.increments(user_id, saved, now), ordered=False)
+        except Exception:
+            pass  # Rollups can be rebuilt with backfill_publish_stats
+        
+        try:
+            if any(r['success'] for r in results):
+                update = {'$set': {'status': 'posted', 'posted_at': now}}
+            else:
+                update = {'$set': {'status': 'failed'}}
+            await db[Post._get_collection_name()].update_one({'_id': post.id}, update)
+        except Exception:
+            pass  # Don't fail if post update fails
+    
+    @staticmethod
+    def rate_limits(platform):
+        """The buckets a platform's first call draws from, or [] if it is not configured"""
+        if platform == 'telegram' and os.getenv("TELEGRAM_TOKEN") and os.getenv("CHAT_ID"):
+            return RateLimiter.telegram(os.getenv("TELEGRAM_TOKEN"), os.getenv("CHAT_ID"))
+        if platform == 'facebook' and os.getenv("FB_ACCESS_TOKEN"):
+            return RateLimiter.facebook(os.getenv("FB_ACCESS_TOKEN"))
+        if platform == 'whatsapp' and os.getenv("WHATSAPP_PHONE_NUMBER_ID"):
+            return RateLimiter.whatsapp(os.getenv("WHATSAPP_PHONE_NUMBER_ID"))
+        return []
+    
+    @staticmethod
+    async def publish_to_platform(post, platform, account, publish_data, owner):
+        """Publish to a single platform, bounded by PUBLISH_PLATFORM_TIMEOUT once its first tokens are in hand"""
+        label = PLATFORM_LABELS[platform]
+        timeout = PUBLISH_PLATFORM_TIMEOUT
+        granted = []
+        
+        try:
+            breakers = (CircuitBreakers.get(platform), CircuitBreakers.get(platform, str(account.id)))
+            for breaker in breakers:
+                if not breaker.allow():
+                    # A half-open breaker already passed us its only trial slot
+                    for other in granted:
+                        other.release()
+                    return {'platform': platform, 'success': False, 'message': breaker.unavailable_message(label)}
+                granted.append(breaker)
+            
+            # Waiting for a rate-limit token is pacing, not a sign of an
+            # unhealthy platform, so it happens before the timeout starts
+            buckets = PostingService.rate_limits(platform)
+            await acquire(buckets)
+            prepaid = bool(buckets)
+            
+            if platform == 'telegram':
+                call = TelegramService.post_to_telegram(post, account, prepaid)
+            elif platform == 'instagram':
+                credentials = publish_data.get('credentials', {}).get('instagram', {})
+                call = run_instagram(InstagramService.post_to_instagram, post, account, owner,
+                                     credentials.get('username'), credentials.get('password'))
+                timeout = INSTAGRAM_PUBLISH_TIMEOUT
+            elif platform == 'facebook':
+                call = FacebookService.post_to_facebook(post, account, prepaid)
+            else:
+                call = WhatsAppService.post_to_whatsapp(post, account, prepaid)
+            
+            transient = False
+            try:
+                success, message = await asyncio.wait_for(call, timeout=timeout)
+            except asyncio.TimeoutError:
+                if platform == 'instagram':
+                    message = f"{label}: outcome unknown, no answer after {timeout:g}s (the upload may still complete)"
+                else:
+                    message = f"{label} error: timed out after {timeout:g}s"
+                success, transient = False, True
+            except TRANSIENT_ERRORS as e:
+                success, message, transient = False, f"{label} error: {str(e)}", True
+            
+            granted = []
+            for breaker in breakers:
+                if success:
+                    breaker.record_success()
+                elif transient:
+                    breaker.record_failure(message)
+                else:
+                    breaker.release()
+            
+            return {'platform': platform, 'success': success, 'message': message}
+        except Exception as e:
+            for breaker in granted:
+                breaker.release()
+            return {'platform': platform, 'success': False, 'message': f'{label} error: {str(e)}'}
+    
+    @staticmethod
+    async def _notify(on_result, result):
+        if on_result is None:
+            return
+        try:
+            await on_result(result)
+        except Exception:
+            pass  # A lost progress update must not fail the publish
+    
+    @staticmethod
+    async def publish_post(post_id, publish_data=None, on_result=None):
+        """Publish post to selected platforms
+        
+        Platforms are published concurrently, so a publish takes about as long as
+        the slowest platform. Set ``mode`` to ``'sequential'`` in ``publish_data``
+        to publish them one after another instead. MongoDB is hit a constant
+        number of times regardless of how many platforms are selected.
+        
+        ``on_result`` is an optional coroutine function awaited with each
+        platform's result as soon as that platform finishes.
+        """
+        try:
+            doc = await get_motor_db()[Post._get_collection_name()].find_one({'_id': ObjectId(post_id)})
+            if not doc:
+                raise Post.DoesNotExist(f"Post {post_id} not found")
+            post = Post._from_son(doc)
             
             if not publish_data:
                 return [{'platform': 'error', 'success': False, 'message': 'No platform data provided'}]
             
             platforms = publish_data.get('platforms', {})
+            selected = [platform for platform in PLATFORM_LABELS if platforms.get(platform)]
+            accounts = await PostingService.aget_accounts(doc['user'], selected)
             
-            # Telegram - WORKING
-            if platforms.get('telegram'):
-                try:
-                    account = SocialAccount.objects(user=post.user, platform='telegram').first()
-                    if not account:
-                        account = SocialAccount(user=post.user, platform='telegram', username='Telegram', is_active=True)
-                        account.save()
-                    
-                    success, message = await TelegramService.post_to_telegram(post, account)
-                    
-                    # Save result
-                    try:
-                        PostResult(post=post, platform=account, success=success, error_message=message if not success else "").save()
-                    except:
-                        pass  # Don't fail if result save fails
-                    
-                    results.append({'platform': 'telegram', 'success': success, 'message': message})
-                except Exception as e:
-                    results.append({'platform': 'telegram', 'success': False, 'message': f'Telegram error: {str(e)}'})
-            
-            # Instagram - DISABLED (IP banned)
-            if platforms.get('instagram'):
-                results.append({'platform': 'instagram', 'success': False, 'message': 'Instagram disabled - IP banned'})
-            
-            # Facebook
-            if platforms.get('facebook'):
-                try:
-                    account = SocialAccount.objects(user=post.user, platform='facebook').first()
-                    if not account:
-                        account = SocialAccount(user=post.user, platform='facebook', username='Facebook', is_active=True)
-                        account.save()
-                    
-                    success, message = FacebookService.post_to_facebook(post, account)
-                    
-                    try:
-                        PostResult(post=post, platform=account, success=success, error_message=message if not success else "").save()
-                    except:
-                        pass
-                    
-                    results.append({'platform': 'facebook', 'success': success, 'message': message})
-                except Exception as e:
-                    results.append({'platform': 'facebook', 'success': False, 'message': f'Facebook error: {str(e)}'})
-            
-            # WhatsApp
-            if platforms.get('whatsapp'):
-                try:
-                    account = SocialAccount.objects(user=post.user, platform='whatsapp').first()
-                    if not account:
-                        account = SocialAccount(user=post.user, platform='whatsapp', username='WhatsApp', is_active=True)
-                        account.save()
-                    
-                    success, message = WhatsAppService.post_to_whatsapp(post, account)
-                    
-                    try:
-                        PostResult(post=post, platform=account, success=success, error_message=message if not success else "").save()
-                    except:
-                        pass
-                    
-                    results.append({'platform': 'whatsapp', 'success': success, 'message': message})
-                except Exception as e:
-                    results.append({'platform': 'whatsapp', 'success': False, 'message': f'WhatsApp error: {str(e)}'})
-            
-            # Update post status
-            try:
-                success_count = sum(1 for r in results if r['success'])
-                if success_count > 0:
-                    post.status = 'posted'
-                    from datetime import datetime
-                    post.posted_at = datetime.utcnow()
-                else:
-                    post.status = 'failed'
-                post.save()
-            except:
-                pass  # Don't fail if post update fails
+            async def publish(platform):
+                result = await PostingService.publish_to_platform(post, platform, accounts[platform], publish_data, doc['user'])
+                await PostingService._notify(on_result, result)
+                return result
+            
+            if publish_data.get('mode') == 'sequential':
+                results = [await publish(platform) for platform in selected]
+            else:
+                results = list(await asyncio.gather(*(publish(platform) for platform in selected)))
             
+            await PostingService.save_results(post, accounts, results, doc['user'])
             return results
             
         except Exception as e:
-            return [{'platform': 'error', 'success': False, 'message': f'System error: {str(e)}'}]
\ No newline at end of file
+            return [{'platform': 'error', 'success': False, 'message': f'System error: {str(e)}'}]
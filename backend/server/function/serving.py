@@ -0,0 +1,184 @@
+import os
+import re
+import mimetypes
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from .media import MEDIA_OBJECTS_DIR, MEDIA_TMP_DIR
+from .uploads import UPLOAD_PARTS_DIR
+
+# How media bytes leave the server. With MEDIA_ACCEL=nginx the view only
+# answers with an X-Accel-Redirect to an internal location aliased to
+# MEDIA_ROOT; with MEDIA_ACCEL=sendfile it sends X-Sendfile (Apache,
+# lighttpd). Either way no Python worker streams the file, which is how
+# production should run. Left empty, Django sends the bytes itself: under WSGI
+# through FileResponse (wsgi.file_wrapper, sendfile where the server has it);
+# under ASGI, which has no sendfile and where Django 4.2 would buffer a sync
+# FileResponse whole, in MEDIA_STREAM_CHUNK_SIZE reads off the event loop.
+MEDIA_ACCEL = os.getenv("MEDIA_ACCEL", "")
+MEDIA_STREAM_CHUNK_SIZE = int(os.getenv("MEDIA_STREAM_CHUNK_SIZE", str(512 * 1024)))
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media/")
+# Content-addressed objects never change and are cached for a year; anything
+# else under MEDIA_ROOT (legacy uploads) for MEDIA_CACHE_MAX_AGE seconds
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", "3600"))
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MEDIA_PRIVATE_DIRS = {MEDIA_TMP_DIR, UPLOAD_PARTS_DIR}
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class _RangeFile:
+    """File object limited to ``length`` bytes from its current position"""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+async def read_chunks(f, offset, length):
+    """Async iterator over ``length`` bytes of ``f`` from ``offset``; closes ``f``"""
+    read = sync_to_async(f.read, thread_sensitive=False)
+    try:
+        await sync_to_async(f.seek, thread_sensitive=False)(offset)
+        while length > 0:
+            data = await read(min(MEDIA_STREAM_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+class MediaServer:
+
+    @staticmethod
+    def resolve(path):
+        """(absolute path, normalised relative path) of a public file under MEDIA_ROOT, or raise Http404"""
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+        except SuspiciousFileOperation:
+            raise Http404("Media not found")
+        # Checked after normalising, so "objects/../tmp/x" cannot reach tmp/
+        path = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, '/')
+        if path.split('/', 1)[0] in MEDIA_PRIVATE_DIRS or not os.path.isfile(full_path):
+            raise Http404("Media not found")
+        return full_path, path
+
+    @staticmethod
+    def is_immutable(path):
+        return path.startswith(f"{MEDIA_OBJECTS_DIR}/")
+
+    @staticmethod
+    def etag(path, stat):
+        if MediaServer.is_immutable(path):
+            # Object and variant names are derived from the content
+            return f'"{os.path.basename(path)}"'
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    @staticmethod
+    def parse_range(header, size):
+        """(start, end) for a single ``bytes=`` range, end exclusive
+
+        Returns None to serve the whole file (no header, or a multi-range
+        request) and raises ValueError when the range cannot be satisfied.
+        """
+        match = _RANGE.match(header.strip()) if header else None
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last or int(last) == 0:
+                raise ValueError("unsatisfiable range")
+            return max(size - int(last), 0), size
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+        if start >= size or end <= start:
+            raise ValueError("unsatisfiable range")
+        return start, end
+
+    @staticmethod
+    def not_modified(request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f"W/{etag}" in tags
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return since is not None and int(last_modified) <= since
+
+    @staticmethod
+    def respond(request, path):
+        full_path, path = MediaServer.resolve(path)
+        stat = os.stat(full_path)
+        etag = MediaServer.etag(path, stat)
+        if MediaServer.is_immutable(path):
+            cache_control = f"public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            cache_control = f"public, max-age={MEDIA_CACHE_MAX_AGE}"
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(stat.st_mtime),
+            'Cache-Control': cache_control,
+            'Accept-Ranges': 'bytes',
+        }
+
+        if MediaServer.not_modified(request, etag, stat.st_mtime):
+            response = HttpResponse(status=304)
+            del response['Content-Type']
+        elif MEDIA_ACCEL:
+            # The front server reads the file and handles Range itself
+            response = HttpResponse()
+            if MEDIA_ACCEL == 'nginx':
+                response['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX.rstrip('/')}/{path}"
+            else:
+                response['X-Sendfile'] = full_path
+            del response['Content-Type']  # let the front server pick it from the file
+        else:
+            response = MediaServer._file_response(request, full_path, stat.st_size, etag)
+
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    @staticmethod
+    def _file_response(request, full_path, size, etag):
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == etag:
+            try:
+                byte_range = MediaServer.parse_range(request.META.get('HTTP_RANGE'), size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f"bytes */{size}"
+                return response
+
+        f = open(full_path, 'rb')
+        if isinstance(request, ASGIRequest):
+            start, end = byte_range or (0, size)
+            response = StreamingHttpResponse(read_chunks(f, start, end - start),
+                                             status=206 if byte_range else 200, content_type=content_type)
+            response['Content-Length'] = end - start
+            if byte_range:
+                response['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+            return response
+        if byte_range is None:
+            # Full files go out through wsgi.file_wrapper, i.e. sendfile()
+            return FileResponse(f, content_type=content_type)
+        start, end = byte_range
+        f.seek(start)
+        response = FileResponse(_RangeFile(f, end - start), status=206, content_type=content_type)
+        response['Content-Length'] = end - start
+        response['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+        return response
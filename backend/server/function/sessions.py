@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import secrets
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .models import UserSession
+
+# API tokens live in a TTL-indexed MongoDB collection so every worker process
+# and host accepts them and they survive restarts. Sessions slide: each use
+# pushes expiry out to SESSION_COOKIE_AGE, but the write happens at most once
+# per SESSION_TOUCH_INTERVAL. A small per-process cache answers repeat
+# lookups for SESSION_CACHE_TTL seconds, which also bounds how long a logout
+# on another process can go unnoticed here.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "30"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_TOUCH_INTERVAL = int(os.getenv("SESSION_TOUCH_INTERVAL", "300"))
+
+class SessionStore(ABC):
+    """Maps opaque login tokens to user ids; ``get`` keeps the old dict API"""
+
+    @staticmethod
+    def new_token():
+        return secrets.token_urlsafe(32)
+
+    @abstractmethod
+    def create(self, user_id):
+        """Start a session and return its token"""
+
+    @abstractmethod
+    def get(self, token, default=None):
+        """The user id for a live token, or ``default``"""
+
+    @abstractmethod
+    def delete(self, token):
+        """End one session"""
+
+    @abstractmethod
+    def delete_user(self, user_id, keep=None):
+        """End every session of a user, except the token in ``keep``"""
+
+class InMemorySessionStore(SessionStore):
+    """Single-process store for development; sessions are lost on restart"""
+
+    def __init__(self):
+        self.sessions = {}  # token -> (user id, expiry as a monotonic time)
+        self._lock = threading.Lock()
+
+    def create(self, user_id):
+        token = self.new_token()
+        with self._lock:
+            self.sessions[token] = (str(user_id), time.monotonic() + settings.SESSION_COOKIE_AGE)
+        return token
+
+    def get(self, token, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self.sessions.get(token)
+            if not entry or entry[1] <= now:
+                self.sessions.pop(token, None)
+                return default
+            self.sessions[token] = (entry[0], now + settings.SESSION_COOKIE_AGE)
+            return entry[0]
+
+    def delete(self, token):
+        with self._lock:
+            self.sessions.pop(token, None)
+
+    def delete_user(self, user_id, keep=None):
+        with self._lock:
+            for token, (owner, _) in list(self.sessions.items()):
+                if owner == str(user_id) and token != keep:
+                    del self.sessions[token]
+
+class MongoSessionStore(SessionStore):
+
+    def __init__(self):
+        self.cache = OrderedDict()  # token digest -> (user id, expires_at, cached at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _remember(self, key, user_id, expires_at):
+        with self._lock:
+            self.cache[key] = (user_id, expires_at, time.monotonic())
+            self.cache.move_to_end(key)
+            while len(self.cache) > SESSION_CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def _forget(self, keys):
+        with self._lock:
+            for key in keys:
+                self.cache.pop(key, None)
+
+    def create(self, user_id):
+        token = self.new_token()
+        expires_at = datetime.utcnow() + timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        UserSession(id=self.key(token), user=user_id, expires_at=expires_at).save(force_insert=True)
+        self._remember(self.key(token), str(user_id), expires_at)
+        return token
+
+    def get(self, token, default=None):
+        if not token:
+            return default
+        key = self.key(token)
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry:
+                self.cache.move_to_end(key)
+        cached = bool(entry and entry[1] > now and time.monotonic() - entry[2] < SESSION_CACHE_TTL)
+        if cached:
+            user_id, expires_at = entry[0], entry[1]
+        else:
+            # The TTL monitor only runs every minute, so check expiry here too
+            doc = UserSession.objects(id=key, expires_at__gt=now).only('user', 'expires_at').as_pymongo().first()
+            if not doc:
+                self._forget([key])
+                return default
+            user_id, expires_at = str(doc['user']), doc['expires_at']
+
+        # Slide the expiry, writing at most once per SESSION_TOUCH_INTERVAL
+        renewed = now + timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        if renewed - expires_at >= timedelta(seconds=SESSION_TOUCH_INTERVAL):
+            if not UserSession.objects(id=key).update_one(set__expires_at=renewed):
+                self._forget([key])  # logged out elsewhere
+                return default
+            expires_at, cached = renewed, False
+        if not cached:
+            self._remember(key, user_id, expires_at)
+        return user_id
+
+    def delete(self, token):
+        if not token:
+            return
+        key = self.key(token)
+        UserSession.objects(id=key).delete()
+        self._forget([key])
+
+    def delete_user(self, user_id, keep=None):
+        sessions = UserSession.objects(user=user_id)
+        if keep:
+            sessions = sessions.filter(id__ne=self.key(keep))
+        keys = [doc['_id'] for doc in sessions.only('id').as_pymongo()]
+        if keys:
+            UserSession.objects(id__in=keys).delete()
+            self._forget(keys)
+
+@lru_cache(maxsize=None)
+def get_session_store():
+    """The process-wide store named by settings.SESSION_STORE"""
+    return import_string(settings.SESSION_STORE)()
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from .clients import get_motor_db
+from .models import TelegramFile
+
+# Telegram returns a file_id for every uploaded photo that the same bot can
+# send again without re-uploading the bytes. file_ids are only valid for the
+# bot that received them, so entries are keyed by bot token and content hash.
+# The cache is only an optimisation: if MongoDB fails, the photo is uploaded
+# again, and a post that was delivered is never reported as failed. Lookups
+# go through motor so they never wait behind blocking work on the publish
+# executor.
+TELEGRAM_FILE_CACHE_SIZE = int(os.getenv("TELEGRAM_FILE_CACHE_SIZE", "4096"))
+
+class TelegramFileCache:
+    _file_ids = OrderedDict()
+    _digests = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def file_digest(path):
+        """sha256 of a file, remembered while its size and mtime are unchanged"""
+        stat = os.stat(path)
+        stat_key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = TelegramFileCache._digests.get(stat_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with TelegramFileCache._lock:
+                TelegramFileCache._digests[stat_key] = digest
+        return digest
+
+    @staticmethod
+    def _key(token, digest):
+        return f"{hashlib.sha256(token.encode()).hexdigest()[:16]}:{digest}"
+
+    @staticmethod
+    def _remember(key, file_id):
+        with TelegramFileCache._lock:
+            TelegramFileCache._file_ids[key] = file_id
+            TelegramFileCache._file_ids.move_to_end(key)
+            while len(TelegramFileCache._file_ids) > TELEGRAM_FILE_CACHE_SIZE:
+                TelegramFileCache._file_ids.popitem(last=False)
+
+    @staticmethod
+    def _collection():
+        return get_motor_db()[TelegramFile._get_collection_name()]
+
+    @staticmethod
+    async def aget(token, digest):
+        key = TelegramFileCache._key(token, digest)
+        file_id = TelegramFileCache._file_ids.get(key)
+        if file_id is None:
+            try:
+                cached = await TelegramFileCache._collection().find_one({'key': key}, {'file_id': 1})
+            except Exception as e:
+                print(f"Telegram file cache lookup failed: {e}")
+                return None
+            if cached:
+                file_id = cached['file_id']
+                TelegramFileCache._remember(key, file_id)
+        return file_id
+
+    @staticmethod
+    async def aput(token, digest, file_id):
+        key = TelegramFileCache._key(token, digest)
+        TelegramFileCache._remember(key, file_id)
+        try:
+            await TelegramFileCache._collection().update_one(
+                {'key': key},
+                {'$set': {'file_id': file_id}, '$setOnInsert': {'created_at': datetime.utcnow()}},
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"Failed to store Telegram file_id: {e}")
+
+    @staticmethod
+    async def aforget(token, digest):
+        key = TelegramFileCache._key(token, digest)
+        with TelegramFileCache._lock:
+            TelegramFileCache._file_ids.pop(key, None)
+        try:
+            await TelegramFileCache._collection().delete_one({'key': key})
+        except Exception as e:
+            print(f"Failed to forget Telegram file_id: {e}")
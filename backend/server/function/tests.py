@@ -1,3 +1,585 @@
-from django.test import TestCase
+import io
+import os
+import asyncio
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+from bson import ObjectId
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from .breaker import CircuitBreaker
+from .image_cache import PromptImageCache
+from .pagination import KeysetPaginator, POSTS_MAX_PAGE_SIZE, POSTS_PAGE_SIZE
+from .ratelimit import TokenBucket, acquire
+from .scheduler import PostScheduler
+from .serving import MediaServer, read_chunks
+from .uploads import ChunkedUploads, UploadError
 
-# Create your tests here.
+class FakeClock:
+    """Stands in for time.monotonic so time only moves when a test says so"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class PostSchedulerPopDueTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = datetime(2024, 1, 1, 12, 0)
+        self.scheduler = PostScheduler(batch_size=2)
+
+    def schedule(self, post_id, scheduled_time):
+        # What refresh() does for each loaded post
+        self.scheduler.scheduled[post_id] = scheduled_time
+        self.scheduler.heap.append((scheduled_time, post_id))
+        self.scheduler.heap.sort()
+
+    def test_pops_due_posts_in_time_order(self):
+        early, late, future = ObjectId(), ObjectId(), ObjectId()
+        self.schedule(late, self.now - timedelta(seconds=5))
+        self.schedule(early, self.now - timedelta(seconds=10))
+        self.schedule(future, self.now + timedelta(seconds=30))
+
+        self.assertEqual(self.scheduler.pop_due(self.now), [early, late])
+        self.assertEqual(self.scheduler.pop_due(self.now), [])
+        self.assertEqual(self.scheduler.seconds_until_next(self.now), 30.0)
+        self.assertIn(future, self.scheduler.scheduled)
+
+    def test_respects_batch_size(self):
+        post_ids = [ObjectId() for _ in range(3)]
+        for offset, post_id in enumerate(post_ids):
+            self.schedule(post_id, self.now - timedelta(seconds=10 - offset))
+
+        self.assertEqual(self.scheduler.pop_due(self.now), post_ids[:2])
+        self.assertEqual(self.scheduler.pop_due(self.now), post_ids[2:])
+
+    def test_skips_stale_entries_after_a_reschedule(self):
+        post_id = ObjectId()
+        self.schedule(post_id, self.now - timedelta(seconds=10))
+        self.schedule(post_id, self.now + timedelta(seconds=60))  # moved later
+
+        self.assertEqual(self.scheduler.pop_due(self.now), [])
+        self.assertEqual(len(self.scheduler.heap), 1)
+        self.assertEqual(self.scheduler.pop_due(self.now + timedelta(seconds=60)), [post_id])
+        self.assertEqual(self.scheduler.scheduled, {})
+
+    def test_stale_entries_do_not_count_towards_the_batch(self):
+        rescheduled, due = ObjectId(), [ObjectId(), ObjectId()]
+        self.schedule(rescheduled, self.now - timedelta(seconds=30))
+        self.scheduler.scheduled[rescheduled] = self.now + timedelta(hours=1)
+        for post_id in due:
+            self.schedule(post_id, self.now - timedelta(seconds=10))
+
+        self.assertCountEqual(self.scheduler.pop_due(self.now), due)
+
+    def test_empty_heap(self):
+        self.assertEqual(self.scheduler.pop_due(self.now), [])
+        self.assertIsNone(self.scheduler.seconds_until_next(self.now))
+
+class PostSchedulerRefreshTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = datetime(2024, 1, 1, 12, 0)
+        self.scheduler = PostScheduler(lookahead=300, update_slack=30)
+        self.docs = []
+        collection = mock.Mock()
+        collection.find.side_effect = lambda query, projection: mock.Mock(sort=mock.Mock(return_value=list(self.docs)))
+        self.find = collection.find
+        patcher = mock.patch('function.scheduler.Post', mock.Mock(_get_collection=mock.Mock(return_value=collection)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_incremental_refresh_also_reads_recently_updated_posts(self):
+        self.scheduler.refresh(self.now)
+        self.scheduler.refresh(self.now + timedelta(seconds=5))
+
+        query = self.find.call_args[0][0]
+        self.assertIn({'updated_at': {'$gte': self.now - timedelta(seconds=30)}}, query['$or'])
+
+    def test_reschedule_inside_the_loaded_window_replaces_the_entry(self):
+        post_id = ObjectId()
+        self.docs = [{'_id': post_id, 'scheduled_time': self.now + timedelta(seconds=60)}]
+        self.assertEqual(self.scheduler.refresh(self.now), 1)
+
+        # Moved earlier, still inside the window already loaded
+        self.docs = [{'_id': post_id, 'scheduled_time': self.now + timedelta(seconds=10)}]
+        self.assertEqual(self.scheduler.refresh(self.now + timedelta(seconds=5)), 1)
+
+        self.assertEqual(self.scheduler.pop_due(self.now + timedelta(seconds=10)), [post_id])
+        self.assertEqual(self.scheduler.pop_due(self.now + timedelta(seconds=60)), [])
+
+    def test_unchanged_posts_are_not_pushed_again(self):
+        self.docs = [{'_id': ObjectId(), 'scheduled_time': self.now + timedelta(seconds=60)}]
+        self.scheduler.refresh(self.now)
+
+        self.assertEqual(self.scheduler.refresh(self.now + timedelta(seconds=5)), 0)
+        self.assertEqual(len(self.scheduler.heap), 1)
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('function.ratelimit.time', mock.Mock(monotonic=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bucket = TokenBucket(rate=1.0, capacity=2)
+
+    def test_burst_then_debt(self):
+        self.assertEqual(self.bucket.reserve(), 0.0)
+        self.assertEqual(self.bucket.reserve(), 0.0)
+        # Every further reservation queues behind the ones before it
+        self.assertEqual(self.bucket.reserve(), 1.0)
+        self.assertEqual(self.bucket.reserve(), 2.0)
+
+    def test_refill_is_capped_at_capacity(self):
+        self.bucket.reserve()
+        self.bucket.reserve()
+        self.clock.advance(60)
+        self.assertEqual(self.bucket.reserve(), 0.0)
+        self.assertEqual(self.bucket.reserve(), 0.0)
+        self.assertEqual(self.bucket.reserve(), 1.0)
+
+    def test_refund_pays_back_debt(self):
+        for _ in range(3):
+            self.bucket.reserve()
+        self.bucket.refund()
+        self.assertEqual(self.bucket.reserve(), 1.0)
+
+    def test_refund_never_exceeds_capacity(self):
+        self.bucket.refund()
+        self.assertEqual(self.bucket.tokens, 2)
+
+    def test_pause_holds_back_the_next_caller(self):
+        self.bucket.pause(5)
+        self.assertGreaterEqual(self.bucket.reserve(), 5.0)
+
+    def test_cancelled_acquire_returns_its_token(self):
+        self.bucket.reserve()
+        self.bucket.reserve()
+
+        async def cancel_while_waiting():
+            task = asyncio.ensure_future(acquire([self.bucket]))
+            await asyncio.sleep(0)  # reserved, now sleeping for a second
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_while_waiting())
+        self.assertEqual(self.bucket.reserve(), 1.0)
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('function.breaker.time', mock.Mock(monotonic=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('telegram', failure_threshold=2, recovery_timeout=10, half_open_calls=1)
+
+    def trip(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure("boom")
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record_failure("boom")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_failure("boom")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure("boom")
+        self.breaker.record_success()
+        self.breaker.record_failure("boom")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_trial_closes_on_success(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())  # one trial at a time
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open_trial_reopens_on_failure(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure("still down")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+
+    def test_release_returns_the_trial_slot(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+    def test_lost_trial_does_not_wedge_the_breaker(self):
+        self.trip()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.allow())
+
+    def test_forced_open_ignores_the_recovery_timeout(self):
+        self.breaker.force_open("IP banned")
+        self.clock.advance(3600)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.unavailable_message('Telegram'), "Telegram disabled - IP banned")
+        self.breaker.reset()
+        self.assertTrue(self.breaker.allow())
+
+class MediaRangeTests(SimpleTestCase):
+
+    def test_parse_range(self):
+        cases = [
+            (None, None),
+            ('bytes=0-99', (0, 100)),
+            ('bytes=900-', (900, 1000)),
+            ('bytes=-100', (900, 1000)),
+            ('bytes=-5000', (0, 1000)),
+            ('bytes=990-5000', (990, 1000)),
+            ('bytes=0-1,5-6', None),  # multi-range: serve the whole file
+            ('items=0-1', None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(MediaServer.parse_range(header, 1000), expected)
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=1000-', 'bytes=1500-1600', 'bytes=-0', 'bytes=5-2', 'bytes=-'):
+            with self.subTest(header=header):
+                with self.assertRaises(ValueError):
+                    MediaServer.parse_range(header, 1000)
+
+class MediaFileResponseTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = os.path.join(self.root.name, 'digits.txt')
+        with open(self.path, 'wb') as f:
+            f.write(b'0123456789')
+        self.factory = RequestFactory()
+
+    def respond(self, **headers):
+        request = self.factory.get('/media/digits.txt', **headers)
+        return MediaServer._file_response(request, self.path, 10, '"tag"')
+
+    def test_unsatisfiable_range_is_416(self):
+        response = self.respond(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_partial_content(self):
+        response = self.respond(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(response['Content-Length'], '3')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        response.close()
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.respond(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        response.close()
+
+    def test_async_chunks_cover_only_the_range(self):
+        async def collect():
+            f = open(self.path, 'rb')
+            chunks = [chunk async for chunk in read_chunks(f, 2, 5)]
+            return chunks, f.closed
+
+        with mock.patch('function.serving.MEDIA_STREAM_CHUNK_SIZE', 2):
+            chunks, closed = asyncio.run(collect())
+        self.assertEqual(chunks, [b'23', b'45', b'6'])
+        self.assertTrue(closed)
+
+    def test_private_directories_are_not_served(self):
+        os.makedirs(os.path.join(self.root.name, 'tmp'))
+        with open(os.path.join(self.root.name, 'tmp', 'secret.jpg'), 'wb') as f:
+            f.write(b'x')
+        with override_settings(MEDIA_ROOT=self.root.name):
+            for path in ('tmp/secret.jpg', 'objects/../tmp/secret.jpg', './tmp/secret.jpg', '../secret.jpg'):
+                with self.subTest(path=path):
+                    with self.assertRaises(Http404):
+                        MediaServer.resolve(path)
+            self.assertEqual(MediaServer.resolve('./digits.txt'), (self.path, 'digits.txt'))
+
+class PromptImageCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.cache = PromptImageCache(directory=self.root.name, max_bytes=10)
+
+    def run_in_thread(self, generate, results):
+        def call():
+            try:
+                results.append(self.cache.get_or_generate('k', generate))
+            except Exception as e:
+                results.append(e)
+        thread = threading.Thread(target=call)
+        thread.start()
+        return thread
+
+    def test_concurrent_misses_generate_once(self):
+        started, release, calls, results = threading.Event(), threading.Event(), [], []
+
+        def generate():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return b'img'
+
+        leader = self.run_in_thread(generate, results)
+        self.assertTrue(started.wait(5))
+        follower = self.run_in_thread(generate, results)
+        follower.join(0.2)
+        self.assertTrue(follower.is_alive())  # waiting on the leader's result
+
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [b'img', b'img'])
+        self.assertEqual(self.cache.inflight, {})
+        self.assertEqual(self.cache.get_or_generate('k', generate), b'img')
+        self.assertEqual(calls, [1])
+
+    def test_failure_reaches_waiters_and_is_not_cached(self):
+        started, release, results = threading.Event(), threading.Event(), []
+
+        def generate():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("generation failed")
+
+        leader = self.run_in_thread(generate, results)
+        self.assertTrue(started.wait(5))
+        follower = self.run_in_thread(generate, results)
+        follower.join(0.2)
+
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual([str(e) for e in results], ["generation failed"] * 2)
+        self.assertEqual(self.cache.inflight, {})
+        self.assertEqual(self.cache.get_or_generate('k', lambda: b'retry'), b'retry')
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', b'aaaa')
+        self.cache.put('b', b'bbbb')
+        self.assertEqual(self.cache.get('a'), b'aaaa')  # b is now the oldest
+        self.cache.put('c', b'cccc')
+
+        self.assertEqual(list(self.cache.index), ['a', 'c'])
+        self.assertEqual(self.cache.total, 8)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertFalse(os.path.exists(os.path.join(self.root.name, 'b.png')))
+
+    def test_reload_orders_entries_by_mtime(self):
+        for age, key in ((300, 'old'), (100, 'new'), (200, 'mid')):
+            path = os.path.join(self.root.name, f'{key}.png')
+            with open(path, 'wb') as f:
+                f.write(b'xx')
+            os.utime(path, (1_700_000_000 - age, 1_700_000_000 - age))
+
+        self.cache._load()
+        self.assertEqual(list(self.cache.index), ['old', 'mid', 'new'])
+        self.assertEqual(self.cache.total, 6)
+
+PNG_HEAD = b'\x89PNG\r\n\x1a\n' + b'\x00' * 8
+
+class UploadContentRangeTests(SimpleTestCase):
+
+    def test_valid_range_is_end_exclusive(self):
+        self.assertEqual(ChunkedUploads.parse_content_range('bytes 0-99/1000', 1000), (0, 100))
+        self.assertEqual(ChunkedUploads.parse_content_range('bytes 900-999/1000', 1000), (900, 1000))
+
+    def test_malformed_header(self):
+        for header in (None, '', 'bytes 0-99/*', 'bytes=0-99/1000', 'items 0-99/1000'):
+            with self.subTest(header=header):
+                with self.assertRaises(UploadError) as raised:
+                    ChunkedUploads.parse_content_range(header, 1000)
+                self.assertEqual(raised.exception.status_code, 400)
+
+    def test_total_must_match_the_session(self):
+        with self.assertRaises(UploadError) as raised:
+            ChunkedUploads.parse_content_range('bytes 0-99/2000', 1000)
+        self.assertEqual(raised.exception.status_code, 400)
+
+    def test_range_outside_the_upload_is_416(self):
+        for header in ('bytes 50-10/1000', 'bytes 900-1000/1000'):
+            with self.subTest(header=header):
+                with self.assertRaises(UploadError) as raised:
+                    ChunkedUploads.parse_content_range(header, 1000)
+                self.assertEqual(raised.exception.status_code, 416)
+
+class UploadSniffTests(SimpleTestCase):
+
+    def test_known_signatures(self):
+        cases = [
+            (b'\xff\xd8\xff\xe0' + b'\x00' * 12, 'image/jpeg'),
+            (PNG_HEAD, 'image/png'),
+            (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image/webp'),
+            (b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00', 'video/mp4'),
+            (b'\x00\x00\x00\x14ftypqt  \x00\x00\x00\x00', 'video/quicktime'),
+            (b'plain text, not media', None),
+        ]
+        for head, expected in cases:
+            with self.subTest(expected=expected):
+                self.assertEqual(ChunkedUploads.sniff(head), expected)
+
+class UploadWriteChunkTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings_patch = override_settings(MEDIA_ROOT=self.root.name)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        self.sessions = mock.Mock()
+        for patcher in (mock.patch('function.uploads.UploadSession', self.sessions),
+                        mock.patch.object(ChunkedUploads, '_hashes', OrderedDict())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.session = SimpleNamespace(id='abc', status='open', offset=0, size=32, content_type='image/png')
+        os.makedirs(os.path.dirname(ChunkedUploads.part_path('abc')))
+        open(ChunkedUploads.part_path('abc'), 'wb').close()
+
+    def write(self, data, start, length=None, checksum=None):
+        length = len(data) if length is None else length
+        content_range = f'bytes {start}-{start + length - 1}/{self.session.size}'
+        return ChunkedUploads.write_chunk(self.session, io.BytesIO(data), content_range, length, checksum=checksum)
+
+    def stored(self):
+        with open(ChunkedUploads.part_path('abc'), 'rb') as f:
+            return f.read()
+
+    def test_chunks_append_at_the_offset(self):
+        self.assertEqual(self.write(PNG_HEAD, 0), 16)
+        self.assertEqual(self.write(b'x' * 16, 16), 32)
+
+        self.assertEqual(self.session.offset, 32)
+        self.assertEqual(self.stored(), PNG_HEAD + b'x' * 16)
+        self.sessions.objects.assert_called_with(id='abc', status='open', offset=16)
+
+    def test_chunk_must_start_at_the_stored_offset(self):
+        with self.assertRaises(UploadError) as raised:
+            self.write(b'x' * 16, 16)
+        self.assertEqual(raised.exception.status_code, 409)
+
+    def test_content_length_must_match_the_range(self):
+        with self.assertRaises(UploadError):
+            ChunkedUploads.write_chunk(self.session, io.BytesIO(PNG_HEAD), 'bytes 0-15/32', 8)
+
+    def test_declared_type_must_match_the_content(self):
+        with self.assertRaises(UploadError) as raised:
+            self.write(b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 4, 0)
+        self.assertEqual(raised.exception.status_code, 415)
+        self.assertEqual(self.stored(), b'')
+
+    def test_short_body_is_truncated_away(self):
+        self.write(PNG_HEAD, 0)
+        with self.assertRaises(UploadError):
+            self.write(b'x' * 10, 16, length=16)
+        self.assertEqual(self.stored(), PNG_HEAD)
+        self.assertEqual(self.session.offset, 16)
+
+    def test_checksum_mismatch_is_truncated_away(self):
+        self.write(PNG_HEAD, 0)
+        with self.assertRaises(UploadError):
+            self.write(b'x' * 16, 16, checksum=hashlib.sha256(b'y' * 16).hexdigest())
+        self.assertEqual(self.stored(), PNG_HEAD)
+
+        self.assertEqual(self.write(b'x' * 16, 16, checksum=hashlib.sha256(b'x' * 16).hexdigest()), 32)
+
+    def test_losing_a_concurrent_write_is_a_conflict(self):
+        self.sessions.objects.return_value.update_one.return_value = 0
+        with self.assertRaises(UploadError) as raised:
+            self.write(PNG_HEAD, 0)
+        self.assertEqual(raised.exception.status_code, 409)
+        self.assertEqual(self.session.offset, 0)
+
+class FakePostQuerySet:
+    """Just enough of a queryset for KeysetPaginator: docs are already newest first"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.filters = []
+
+    def filter(self, *args, **kwargs):
+        self.filters.append((args, kwargs))
+        return self
+
+    def order_by(self, *keys):
+        return self
+
+    def limit(self, count):
+        return self.docs[:count]
+
+class KeysetPaginatorTests(SimpleTestCase):
+
+    def setUp(self):
+        start = datetime(2024, 1, 1)
+        self.docs = [SimpleNamespace(created_at=start - timedelta(minutes=i), id=ObjectId()) for i in range(3)]
+
+    def test_cursor_round_trip(self):
+        doc = self.docs[1]
+        cursor = KeysetPaginator.encode(doc)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(KeysetPaginator.decode(cursor), (doc.created_at, doc.id))
+
+    def test_malformed_cursor(self):
+        for cursor in ('', 'not-a-cursor', KeysetPaginator.encode(self.docs[0])[:-4]):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    KeysetPaginator.decode(cursor)
+
+    def test_page_size(self):
+        self.assertEqual(KeysetPaginator.page_size(None), POSTS_PAGE_SIZE)
+        self.assertEqual(KeysetPaginator.page_size(''), POSTS_PAGE_SIZE)
+        self.assertEqual(KeysetPaginator.page_size('5'), 5)
+        self.assertEqual(KeysetPaginator.page_size(str(POSTS_MAX_PAGE_SIZE + 1)), POSTS_MAX_PAGE_SIZE)
+        for value in ('0', '-1', 'ten'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    KeysetPaginator.page_size(value)
+
+    def test_more_pages_yield_a_cursor_at_the_last_doc(self):
+        docs, next_cursor = KeysetPaginator.paginate(FakePostQuerySet(self.docs), limit=2)
+        self.assertEqual(docs, self.docs[:2])
+        self.assertEqual(KeysetPaginator.decode(next_cursor), (self.docs[1].created_at, self.docs[1].id))
+
+    def test_exactly_full_last_page_has_no_cursor(self):
+        docs, next_cursor = KeysetPaginator.paginate(FakePostQuerySet(self.docs), limit=3)
+        self.assertEqual(docs, self.docs)
+        self.assertIsNone(next_cursor)
+
+    def test_cursor_filters_after_its_position(self):
+        queryset = FakePostQuerySet(self.docs[2:])
+        cursor = KeysetPaginator.encode(self.docs[1])
+        docs, next_cursor = KeysetPaginator.paginate(queryset, cursor=cursor, limit=2)
+        self.assertEqual(len(queryset.filters), 1)
+        self.assertEqual(docs, self.docs[2:])
+        self.assertIsNone(next_cursor)
@@ -0,0 +1,221 @@
+import os
+import re
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from django.conf import settings
+from .media import MediaStore
+from .models import UploadSession
+
+# Large media is sent as a series of chunk PUTs against an upload session, so
+# a slow client only holds a worker for one chunk at a time and a dropped
+# connection resumes from the last stored offset. Chunks are streamed to a
+# part file under MEDIA_ROOT/uploads and never buffered whole in memory.
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(500 * 1024 * 1024)))
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", str(16 * 1024 * 1024)))
+UPLOAD_READ_SIZE = 64 * 1024
+UPLOAD_PARTS_DIR = 'uploads'
+
+# The first bytes of the file decide what it really is; the declared content
+# type has to agree with them
+UPLOAD_SIGNATURES = [
+    ('image/jpeg', 0, b'\xff\xd8\xff'),
+    ('image/png', 0, b'\x89PNG\r\n\x1a\n'),
+    ('image/gif', 0, b'GIF8'),
+    ('image/webp', 8, b'WEBP'),
+    ('video/mp4', 4, b'ftyp'),
+    ('video/quicktime', 4, b'ftypqt'),
+    ('video/webm', 0, b'\x1a\x45\xdf\xa3'),
+]
+UPLOAD_CONTENT_TYPES = {content_type for content_type, _, _ in UPLOAD_SIGNATURES}
+UPLOAD_SNIFF_SIZE = 16
+
+# Running sha256 of sessions whose chunks arrived in order on this process, so
+# finalising does not have to read the whole part file back
+UPLOAD_HASH_CACHE_SIZE = 256
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class ChunkedUploads:
+    _hashes = OrderedDict()  # session id -> (offset, sha256)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def part_path(session_id):
+        return os.path.join(settings.MEDIA_ROOT, UPLOAD_PARTS_DIR, f"{session_id}.part")
+
+    @staticmethod
+    def sniff(head):
+        """Content type matching the file's leading bytes, or None"""
+        matches = [content_type for content_type, offset, magic in UPLOAD_SIGNATURES
+                   if head[offset:offset + len(magic)] == magic]
+        return matches[-1] if matches else None  # quicktime is the more specific ftyp
+
+    @staticmethod
+    def parse_content_range(header, size):
+        """(start, end) of a ``bytes start-end/total`` header, end exclusive"""
+        match = _CONTENT_RANGE.match(header or '')
+        if not match:
+            raise UploadError("Content-Range header must be 'bytes start-end/total'")
+        start, last, total = (int(value) for value in match.groups())
+        if total != size:
+            raise UploadError(f"Upload size is {size} bytes, not {total}")
+        if last < start or last >= size:
+            raise UploadError("Content-Range is outside the upload", 416)
+        return start, last + 1
+
+    @staticmethod
+    def start(user, filename, size, content_type):
+        if content_type not in UPLOAD_CONTENT_TYPES:
+            raise UploadError(f"Unsupported content type: {content_type}", 415)
+        if size <= 0:
+            raise UploadError("Upload size must be positive")
+        if size > UPLOAD_MAX_SIZE:
+            raise UploadError(f"Uploads are limited to {UPLOAD_MAX_SIZE} bytes", 413)
+
+        session = UploadSession(
+            id=uuid.uuid4().hex,
+            user=user,
+            filename=os.path.basename(filename or '')[:255],
+            content_type=content_type,
+            size=size,
+        )
+        path = ChunkedUploads.part_path(session.id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        session.save(force_insert=True)
+        with ChunkedUploads._lock:
+            ChunkedUploads._remember(session.id, 0, hashlib.sha256())
+        return session
+
+    @staticmethod
+    def _remember(session_id, offset, sha):
+        ChunkedUploads._hashes[session_id] = (offset, sha)
+        ChunkedUploads._hashes.move_to_end(session_id)
+        while len(ChunkedUploads._hashes) > UPLOAD_HASH_CACHE_SIZE:
+            ChunkedUploads._hashes.popitem(last=False)
+
+    @staticmethod
+    def write_chunk(session, stream, content_range, length, checksum=None):
+        """Append one chunk read from ``stream``; returns the new offset
+
+        The chunk must start exactly at the stored offset. ``checksum`` is an
+        optional hex sha256 of the chunk; on a mismatch nothing is kept and
+        the client resends the same range.
+        """
+        if session.status != 'open':
+            raise UploadError("Upload is already complete", 409)
+        start, end = ChunkedUploads.parse_content_range(content_range, session.size)
+        if start != session.offset:
+            raise UploadError(f"Expected a chunk at offset {session.offset}", 409)
+        if length != end - start:
+            raise UploadError("Content-Length does not match Content-Range")
+        if length > UPLOAD_MAX_CHUNK_SIZE:
+            raise UploadError(f"Chunks are limited to {UPLOAD_MAX_CHUNK_SIZE} bytes", 413)
+
+        with ChunkedUploads._lock:
+            cached = ChunkedUploads._hashes.pop(session.id, None)
+        running = cached[1].copy() if cached and cached[0] == start else None
+        chunk_sha = hashlib.sha256()
+        received = 0
+        path = ChunkedUploads.part_path(session.id)
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            try:
+                while received < length:
+                    data = stream.read(min(UPLOAD_READ_SIZE, length - received))
+                    if not data:
+                        break
+                    if received == 0 and start == 0:
+                        data = ChunkedUploads._check_type(session, data, stream, length)
+                    received += len(data)
+                    chunk_sha.update(data)
+                    if running is not None:
+                        running.update(data)
+                    f.write(data)
+                if received != length:
+                    raise UploadError("Chunk ended early; resend it from the current offset")
+                if checksum and checksum.lower() != chunk_sha.hexdigest():
+                    raise UploadError("Chunk checksum mismatch; resend it from the current offset")
+            except BaseException:
+                f.truncate(start)
+                raise
+
+        # Only the first of two racing writers for the same range moves the offset
+        if not UploadSession.objects(id=session.id, status='open', offset=start).update_one(
+            set__offset=end, set__updated_at=datetime.utcnow()
+        ):
+            raise UploadError("Chunk was written concurrently; check the current offset", 409)
+        session.offset = end
+        if running is not None:
+            with ChunkedUploads._lock:
+                ChunkedUploads._remember(session.id, end, running)
+        return end
+
+    @staticmethod
+    def _check_type(session, data, stream, length):
+        """Reject the upload unless its leading bytes match the declared type"""
+        head = data
+        while len(head) < min(UPLOAD_SNIFF_SIZE, length):
+            more = stream.read(min(UPLOAD_SNIFF_SIZE, length) - len(head))
+            if not more:
+                break
+            head += more
+        detected = ChunkedUploads.sniff(head)
+        if detected is None or detected.split('/')[0] != session.content_type.split('/')[0]:
+            raise UploadError(f"File content does not look like {session.content_type}", 415)
+        return head
+
+    @staticmethod
+    def finalise(session):
+        """Move the complete part file into the media store; returns the media id"""
+        if session.status == 'complete':
+            return session.media_id
+        if session.offset != session.size:
+            raise UploadError(f"Upload is incomplete: {session.offset} of {session.size} bytes", 409)
+
+        path = ChunkedUploads.part_path(session.id)
+        with ChunkedUploads._lock:
+            cached = ChunkedUploads._hashes.pop(session.id, None)
+        if cached and cached[0] == session.size:
+            digest = cached[1].hexdigest()
+        else:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+                    sha.update(data)
+            digest = sha.hexdigest()
+
+        ext = MediaStore.extension(session.filename, session.content_type)
+        media_id = MediaStore.commit(path, digest, ext, session.size, session.content_type)
+        UploadSession.objects(id=session.id).update_one(
+            set__status='complete', set__media_id=media_id, set__updated_at=datetime.utcnow()
+        )
+        session.status = 'complete'
+        session.media_id = media_id
+        return media_id
+
+    @staticmethod
+    def abort(session):
+        with ChunkedUploads._lock:
+            ChunkedUploads._hashes.pop(session.id, None)
+        path = ChunkedUploads.part_path(session.id)
+        if os.path.exists(path):
+            os.remove(path)
+        session.delete()
+
+    @staticmethod
+    def prune(older_than):
+        """Drop upload sessions, and any part files, untouched since ``older_than``"""
+        removed = 0
+        for session in UploadSession.objects(updated_at__lt=older_than):
+            ChunkedUploads.abort(session)
+            removed += 1
+        return removed
@@ -1,16 +1,25 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'posts', views.PostViewSet, basename='post')
 router.register(r'accounts', views.SocialAccountViewSet, basename='socialaccount')
+router.register(r'jobs', views.PublishJobViewSet, basename='publishjob')
+router.register(r'generation-jobs', views.GenerationJobViewSet, basename='generationjob')
+router.register(r'uploads', views.UploadViewSet, basename='upload')
 
 urlpatterns = [
+    path('api/posts/<str:pk>/publish/', async_views.publish_post, name='post-publish'),
+    path('api/posts/<str:pk>/publish/stream/', async_views.publish_post_stream, name='post-publish-stream'),
+    path('api/jobs/<str:pk>/stream/', async_views.publish_job_stream, name='publishjob-stream'),
     path('api/', include(router.urls)),
     path('api/auth/register/', views.create_user, name='register'),
     path('api/auth/login/', views.login_user, name='login'),
     path('api/auth/logout/', views.logout_user, name='logout'),
     path('api/auth/profile/', views.user_profile, name='profile'),
     path('api/auth/change-password/', views.change_password, name='change_password'),
+    path('api/platforms/circuits/', views.platform_circuits, name='platform_circuits'),
+    path('api/platforms/circuits/reset/', views.reset_circuit, name='reset_circuit'),
+    path('api/analytics/publishing/', views.publish_analytics, name='publish_analytics'),
 ]
\ No newline at end of file
@@ -1,110 +1,172 @@
-import asyncio
 import os
 import base64
-import uuid
+from datetime import timezone as dt_timezone
 from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework import viewsets, status
+from django.views.decorators.http import require_safe
+from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import Post, SocialAccount, PostResult, User
-from .serializers import PostSerializer, SocialAccountSerializer, PostResultSerializer
-from .services import ImageGenerator, PostingService
+from .models import Post, SocialAccount, PostResult, User, PublishJob, GenerationJob, UploadSession
+from .serializers import POST_SUMMARY_EXCLUDE, PostSerializer, SocialAccountSerializer, PostResultSerializer, PublishJobSerializer, GenerationJobSerializer, UploadSessionSerializer
+from .services import ImageGenerator, PostingService, PLATFORM_LABELS
+from .jobs import PublishJobQueue, GenerationJobQueue, GENERATION_MAX_BATCH
+from .breaker import CircuitBreakers
+from .media import MediaStore
+from .pagination import KeysetPaginator
+from .sessions import get_session_store
+from .authentication import PrincipalCache
+from .serving import MediaServer
+from .analytics import PublishAnalytics
+from .instagram import InstagramSessionStore
+from .uploads import ChunkedUploads, UploadError, UPLOAD_MAX_CHUNK_SIZE
 from django.core.files.base import ContentFile
+from mongoengine.errors import ValidationError
+from bson import ObjectId
 
-# Simple in-memory session storage
-user_sessions = {}
+# Login tokens, shared by every worker process (see function.sessions)
+user_sessions = get_session_store()
 
 class PostViewSet(viewsets.ViewSet):
     parser_classes = (MultiPartParser, FormParser)
     
     def list(self, request):
-        session_id = request.META.get('HTTP_AUTHORIZATION', '').replace('Bearer ', '')
-        user_id = user_sessions.get(session_id)
-        if not user_id:
+        if not request.user:
             return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
         
+        params = request.query_params
+        # Account references stay raw ids; the serializer loads them per page
+        posts = Post.objects(user=request.user.id).no_dereference()
         try:
-            user = User.objects.get(id=user_id)
-            posts = Post.objects(user=user)
-            serializer = PostSerializer(posts, many=True)
-            return Response(serializer.data)
-        except User.DoesNotExist:
-            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            statuses = [s for s in params.get('status', '').split(',') if s]
+            if statuses:
+                valid = {choice for choice, _ in Post.STATUS_CHOICES}
+                if not set(statuses) <= valid:
+                    raise ValueError(f"status must be one of {', '.join(sorted(valid))}")
+                posts = posts.filter(status__in=statuses)
+            if params.get('created_after'):
+                posts = posts.filter(created_at__gte=self._parse_datetime(params['created_after']))
+            if params.get('created_before'):
+                posts = posts.filter(created_at__lt=self._parse_datetime(params['created_before']))
+            
+            summary = params.get('fields') == 'summary'
+            if summary:
+                posts = posts.exclude(*POST_SUMMARY_EXCLUDE)
+            
+            limit = KeysetPaginator.page_size(params.get('limit'))
+            page, next_cursor = KeysetPaginator.paginate(posts, params.get('cursor'), limit)
+        except (ValueError, serializers.ValidationError) as e:
+            detail = e.detail[0] if isinstance(e, serializers.ValidationError) else str(e)
+            return Response({'error': detail}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = PostSerializer(page, many=True, exclude=POST_SUMMARY_EXCLUDE if summary else ())
+        return Response({'results': serializer.data, 'next_cursor': next_cursor})
+    
+    @staticmethod
+    def _parse_datetime(value):
+        parsed = serializers.DateTimeField().to_internal_value(value)
+        if timezone.is_aware(parsed):
+            parsed = timezone.make_naive(parsed, dt_timezone.utc)
+        return parsed
     
     def create(self, request):
-        # Get token from Authorization header
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        if not auth_header.startswith('Bearer '):
-            return Response({'error': 'No authorization header'}, status=status.HTTP_401_UNAUTHORIZED)
-        
-        session_id = auth_header.replace('Bearer ', '')
-        user_id = user_sessions.get(session_id)
-        
-        if not user_id:
-            return Response({'error': f'Invalid token: {session_id[:10]}...'}, status=status.HTTP_401_UNAUTHORIZED)
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            user = User.objects.get(id=user_id)
+            user = request.user.id
             data = request.data.copy()
             
             # Handle image upload
             image_path = ''
+            media_id = None
             if 'image' in request.FILES:
-                image = request.FILES['image']
-                import os
-                from django.conf import settings
-                media_path = os.path.join(settings.MEDIA_ROOT, 'posts')
-                os.makedirs(media_path, exist_ok=True)
-                image_path = os.path.join(media_path, image.name)
-                with open(image_path, 'wb') as f:
-                    for chunk in image.chunks():
-                        f.write(chunk)
-                image_path = f'/media/posts/{image.name}'
+                # Large files should go through /api/uploads/ in chunks instead
+                if request.FILES['image'].size > UPLOAD_MAX_CHUNK_SIZE:
+                    return Response({'error': f'Images over {UPLOAD_MAX_CHUNK_SIZE} bytes must use /api/uploads/'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+                media_id = MediaStore.save_upload(request.FILES['image'])
+                image_path = MediaStore.url(media_id)
+            elif data.get('media_id'):
+                # Media already on the server, e.g. from generate_image
+                media_id = data['media_id']
+                if not MediaStore.is_media_id(media_id) or not MediaStore.acquire(media_id):
+                    return Response({'error': 'Unknown media_id'}, status=status.HTTP_400_BAD_REQUEST)
+                image_path = MediaStore.url(media_id)
+            
+            # Scheduled posts are queued by scheduler.py when they come due
+            post_status = data.get('status', 'draft')
+            scheduled_time = None
+            if data.get('scheduled_time'):
+                scheduled_time = serializers.DateTimeField().to_internal_value(data['scheduled_time'])
+                if timezone.is_aware(scheduled_time):
+                    scheduled_time = timezone.make_naive(scheduled_time, dt_timezone.utc)
+                post_status = 'scheduled'
+            
+            import json
+            selected = json.loads(data.get('platforms', '{}'))
+            names = [p for p in PLATFORM_LABELS if selected.get(p)]
+            if scheduled_time and not names:
+                return Response({'error': 'Scheduled posts need at least one platform'}, status=status.HTTP_400_BAD_REQUEST)
+            accounts = PostingService.get_accounts(user, names)
+            platforms = list(accounts.values())
             
             post = Post(
                 user=user,
                 title=data['title'],
                 content=data['content'],
                 image_path=image_path,
+                media_id=media_id,
                 generated_image_prompt=data.get('generated_image_prompt', ''),
-                status=data.get('status', 'draft')
+                platforms=platforms,
+                status=post_status,
+                scheduled_time=scheduled_time
             ).save()
             
             serializer = PostSerializer(post)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        except User.DoesNotExist:
-            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        except serializers.ValidationError as e:
+            return Response({'error': e.detail}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     def retrieve(self, request, pk=None):
-        session_id = request.META.get('HTTP_AUTHORIZATION', '').replace('Bearer ', '')
-        user_id = user_sessions.get(session_id)
-        if not user_id:
+        if not request.user:
             return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            user = User.objects.get(id=user_id)
-            post = Post.objects.get(id=pk, user=user)
+            post = Post.objects.no_dereference().get(id=pk, user=request.user.id)
             serializer = PostSerializer(post)
             return Response(serializer.data)
-        except (User.DoesNotExist, Post.DoesNotExist):
+        except (Post.DoesNotExist, ValidationError):
+            return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    @action(detail=True, methods=['get'])
+    def results(self, request, pk=None):
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            if not Post.objects(id=pk, user=request.user.id).only('id').first():
+                return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError:
             return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
+        results = PostResult.objects(post=pk).no_dereference().order_by('-posted_at')
+        serializer = PostResultSerializer(results, many=True)
+        return Response(serializer.data)
     
     def destroy(self, request, pk=None):
-        session_id = request.META.get('HTTP_AUTHORIZATION', '').replace('Bearer ', '')
-        user_id = user_sessions.get(session_id)
-        if not user_id:
+        if not request.user:
             return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            user = User.objects.get(id=user_id)
-            post = Post.objects.get(id=pk, user=user)
+            post = Post.objects.only('id', 'media_id').get(id=pk, user=request.user.id)
             post.delete()
+            if post.media_id:
+                MediaStore.release(post.media_id)
             return Response(status=status.HTTP_204_NO_CONTENT)
-        except (User.DoesNotExist, Post.DoesNotExist):
+        except (Post.DoesNotExist, ValidationError):
             return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
     
     @action(detail=False, methods=['post'])
@@ -114,62 +176,199 @@ class PostViewSet(viewsets.ViewSet):
             return Response({'error': 'Prompt is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            image_base64 = ImageGenerator.generate_image(prompt)
+            # Stored server-side; create() takes the media_id instead of a re-upload
+            image = ImageGenerator.generate_image_bytes(prompt)
+            media_id = MediaStore.save_bytes(image, '.png', 'image/png')
             return Response({
-                'image_base64': image_base64,
+                'media_id': media_id,
+                'url': MediaStore.url(media_id),
+                'thumbnail_url': MediaStore.variant_url(media_id, 'thumb'),
                 'filename': f'generated-{len(prompt)}.png'
             })
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     @action(detail=True, methods=['post'])
-    def publish(self, request, pk=None):
-        # Get token from Authorization header
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        if not auth_header.startswith('Bearer '):
-            return Response({'error': 'No authorization header'}, status=status.HTTP_401_UNAUTHORIZED)
-        
-        session_id = auth_header.replace('Bearer ', '')
-        user_id = user_sessions.get(session_id)
-        
-        if not user_id:
-            return Response({'error': f'Invalid token: {session_id[:10]}...'}, status=status.HTTP_401_UNAUTHORIZED)
+    def publish_async(self, request, pk=None):
+        """Queue the post for a background worker and return immediately"""
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            user = User.objects.get(id=user_id)
-            post = Post.objects.get(id=pk, user=user)
+            post = Post.objects.only('id').get(id=pk, user=request.user.id)
             
-            # Handle form data
             import json
+            platforms = json.loads(request.data.get('platforms', '{}'))
+            credentials = json.loads(request.data.get('credentials', '{}')).get('instagram', {})
+            
+            # Jobs never store the password: log in now so the worker can use
+            # this user's stored Instagram session
+            username = credentials.get('username')
+            if platforms.get('instagram') and username and credentials.get('password'):
+                try:
+                    InstagramSessionStore.ensure(request.user.id, username, credentials['password'])
+                except Exception as e:
+                    return Response({'error': f'Instagram login failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+            
             publish_data = {
-                'platforms': json.loads(request.data.get('platforms', '{}')),
-                'credentials': json.loads(request.data.get('credentials', '{}'))
+                'platforms': platforms,
+                'credentials': {'instagram': {'username': username}} if username else {},
             }
+            job = PublishJobQueue.enqueue(post, request.user.id, publish_data)
             
-            # Run async function in sync context
-            results = asyncio.run(PostingService.publish_post(str(post.id), publish_data))
-            
-            return Response({'results': results})
-        except (User.DoesNotExist, Post.DoesNotExist):
+            return Response({
+                'job_id': str(job.id),
+                'status': job.status,
+                'status_url': f'/api/jobs/{job.id}/'
+            }, status=status.HTTP_202_ACCEPTED)
+        except (Post.DoesNotExist, ValidationError):
             return Response({'error': 'Post not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class SocialAccountViewSet(viewsets.ViewSet):
+class PublishJobViewSet(viewsets.ViewSet):
     
-    def list(self, request):
-        session_id = request.META.get('HTTP_AUTHORIZATION', '').replace('Bearer ', '')
-        user_id = user_sessions.get(session_id)
-        if not user_id:
+    def retrieve(self, request, pk=None):
+        if not request.user:
             return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            user = User.objects.get(id=user_id)
-            accounts = SocialAccount.objects(user=user)
-            serializer = SocialAccountSerializer(accounts, many=True)
+            job = PublishJob.objects.exclude('publish_data').get(id=pk, user=request.user.id)
+            serializer = PublishJobSerializer(job)
             return Response(serializer.data)
-        except User.DoesNotExist:
-            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        except (PublishJob.DoesNotExist, ValidationError):
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+class GenerationJobViewSet(viewsets.ViewSet):
+    
+    def create(self, request):
+        """Queue one or many prompts for background image generation"""
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        prompts = request.data.get('prompts') or ([request.data['prompt']] if request.data.get('prompt') else [])
+        if not isinstance(prompts, list) or not all(isinstance(p, str) and p.strip() for p in prompts) or not prompts:
+            return Response({'error': 'Prompt is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(prompts) > GENERATION_MAX_BATCH:
+            return Response({'error': f'At most {GENERATION_MAX_BATCH} prompts per request'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            params = GenerationJobQueue.clean_params(request.data.get('params') or {})
+        except (TypeError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        batch_id, jobs = GenerationJobQueue.enqueue_many(request.user.id, prompts, params)
+        return Response({
+            'batch_id': batch_id,
+            'jobs': [{'job_id': str(job.id), 'prompt': job.prompt, 'status': job.status} for job in jobs]
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    def list(self, request):
+        """Poll a batch (?batch_id=) or specific jobs (?ids=a,b)"""
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        jobs = GenerationJob.objects(user=request.user.id)
+        if request.query_params.get('batch_id'):
+            jobs = jobs.filter(batch_id=request.query_params['batch_id'])
+        elif request.query_params.get('ids'):
+            ids = [i for i in request.query_params['ids'].split(',') if ObjectId.is_valid(i)]
+            jobs = jobs.filter(id__in=ids)
+        else:
+            return Response({'error': 'batch_id or ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        serializer = GenerationJobSerializer(jobs.order_by('created_at'), many=True)
+        return Response(serializer.data)
+    
+    def retrieve(self, request, pk=None):
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            job = GenerationJob.objects.get(id=pk, user=request.user.id)
+            return Response(GenerationJobSerializer(job).data)
+        except (GenerationJob.DoesNotExist, ValidationError):
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+class UploadViewSet(viewsets.ViewSet):
+    """Resumable chunked uploads: start a session, PUT chunks, then finalise"""
+    
+    def _get_session(self, request, pk):
+        if not request.user:
+            return None, Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        upload = UploadSession.objects(id=pk, user=request.user.id).first()
+        if not upload:
+            return None, Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        return upload, None
+    
+    def create(self, request):
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({'error': 'size is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            upload = ChunkedUploads.start(request.user.id, request.data.get('filename'), size, request.data.get('content_type'))
+        except UploadError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        return Response(UploadSessionSerializer(upload).data, status=status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None):
+        """Current offset, for resuming after a dropped connection"""
+        upload, error = self._get_session(request, pk)
+        if error:
+            return error
+        return Response(UploadSessionSerializer(upload).data)
+    
+    def update(self, request, pk=None):
+        """Write the chunk in the request body at the range given by Content-Range"""
+        upload, error = self._get_session(request, pk)
+        if error:
+            return error
+        
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            # Read the raw body stream; touching request.data would buffer it
+            ChunkedUploads.write_chunk(
+                upload, request.stream, request.META.get('HTTP_CONTENT_RANGE'), length,
+                checksum=request.META.get('HTTP_X_CHUNK_SHA256'),
+            )
+        except UploadError as e:
+            return Response({'error': str(e), 'offset': upload.offset}, status=e.status_code)
+        return Response({'id': upload.id, 'offset': upload.offset, 'size': upload.size})
+    
+    def destroy(self, request, pk=None):
+        upload, error = self._get_session(request, pk)
+        if error:
+            return error
+        ChunkedUploads.abort(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['post'])
+    def finalise(self, request, pk=None):
+        """Move the completed upload into the media store; pass the media_id to post creation"""
+        upload, error = self._get_session(request, pk)
+        if error:
+            return error
+        
+        try:
+            ChunkedUploads.finalise(upload)
+        except UploadError as e:
+            return Response({'error': str(e), 'offset': upload.offset}, status=e.status_code)
+        return Response(UploadSessionSerializer(upload).data)
+
+class SocialAccountViewSet(viewsets.ViewSet):
+    
+    def list(self, request):
+        if not request.user:
+            return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        accounts = SocialAccount.objects(user=request.user.id)
+        serializer = SocialAccountSerializer(accounts, many=True)
+        return Response(serializer.data)
 
 @csrf_exempt
 @api_view(['POST'])
@@ -195,8 +394,7 @@ def login_user(request):
     
     user = User.objects(username=username).first()
     if user and user.check_password(password):
-        session_id = str(uuid.uuid4())
-        user_sessions[session_id] = str(user.id)
+        session_id = user_sessions.create(user.id)
         return Response({
             'message': 'Login successful', 
             'user_id': str(user.id),
@@ -209,44 +407,36 @@ def login_user(request):
 @csrf_exempt
 @api_view(['POST'])
 def logout_user(request):
-    session_id = request.META.get('HTTP_AUTHORIZATION', '').replace('Bearer ', '')
-    if session_id in user_sessions:
-        del user_sessions[session_id]
+    if request.user:
+        user_sessions.delete(request.auth)
+        PrincipalCache.invalidate(request.user.id)
     return Response({'message': 'Logged out successfully'})
 
 @csrf_exempt
 @api_view(['GET', 'PUT'])
 def user_profile(request):
-    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-    if not auth_header.startswith('Bearer '):
+    if not request.user:
         return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    session_id = auth_header.replace('Bearer ', '')
-    user_id = user_sessions.get(session_id)
-    
-    if not user_id:
-        return Response({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
+    if request.method == 'GET':
+        return Response({
+            'username': request.user.username,
+            'email': request.user.email,
+            'id': str(request.user.id)
+        })
     
     try:
-        user = User.objects.get(id=user_id)
-        
-        if request.method == 'GET':
-            return Response({
-                'username': user.username,
-                'email': user.email,
-                'id': str(user.id)
-            })
+        user = User.objects.get(id=request.user.id)
+        user.username = request.data.get('username', user.username)
+        user.email = request.data.get('email', user.email)
+        user.save()
+        PrincipalCache.invalidate(user.id)
         
-        elif request.method == 'PUT':
-            user.username = request.data.get('username', user.username)
-            user.email = request.data.get('email', user.email)
-            user.save()
-            
-            return Response({
-                'message': 'Profile updated successfully',
-                'username': user.username,
-                'email': user.email
-            })
+        return Response({
+            'message': 'Profile updated successfully',
+            'username': user.username,
+            'email': user.email
+        })
     
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -254,18 +444,11 @@ def user_profile(request):
 @csrf_exempt
 @api_view(['POST'])
 def change_password(request):
-    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-    if not auth_header.startswith('Bearer '):
+    if not request.user:
         return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    session_id = auth_header.replace('Bearer ', '')
-    user_id = user_sessions.get(session_id)
-    
-    if not user_id:
-        return Response({'error': 'Invalid token'}, status=status.HTTP_401_UNAUTHORIZED)
-    
     try:
-        user = User.objects.get(id=user_id)
+        user = User.objects.get(id=request.user.id)
         current_password = request.data.get('currentPassword')
         new_password = request.data.get('newPassword')
         
@@ -274,8 +457,74 @@ def change_password(request):
         
         user.set_password(new_password)
         user.save()
+        # Sign out every other session of this user
+        user_sessions.delete_user(user.id, keep=request.auth)
+        PrincipalCache.invalidate(user.id)
         
         return Response({'message': 'Password changed successfully'})
     
     except User.DoesNotExist:
-        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+def own_circuit_names(user_id):
+    """Names of the per-account breakers for a user's social accounts"""
+    accounts = SocialAccount.objects(user=user_id).only('id', 'platform').as_pymongo()
+    return {f"{account['platform']}:{account['_id']}" for account in accounts}
+
+@api_view(['GET'])
+def platform_circuits(request):
+    if not request.user:
+        return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    circuits = CircuitBreakers.snapshot()
+    if not request.user.is_staff:
+        # Platform breakers without other users' errors, plus the user's own accounts
+        own = own_circuit_names(request.user.id)
+        circuits = [
+            circuit if circuit['name'] in own else {**circuit, 'last_error': None}
+            for circuit in circuits if circuit['name'] in own or circuit['name'] in PLATFORM_LABELS
+        ]
+    # Breakers live in each process's memory: this is the answering web
+    # process only, not the other web workers or worker.py
+    return Response({'circuits': circuits, 'scope': 'process', 'pid': os.getpid()})
+
+@csrf_exempt
+@api_view(['POST'])
+def reset_circuit(request):
+    if not request.user:
+        return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    platform = request.data.get('platform')
+    if platform not in PLATFORM_LABELS:
+        return Response({'error': 'Unknown platform'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    account_id = request.data.get('account_id')
+    # Users may only retry their own accounts; platform-wide and operator
+    # disabled breakers are for staff
+    if not request.user.is_staff and f"{platform}:{account_id}" not in own_circuit_names(request.user.id):
+        return Response({'error': 'Only staff can reset this circuit'}, status=status.HTTP_403_FORBIDDEN)
+    breaker = CircuitBreakers.get(platform, account_id)
+    if not request.user.is_staff and breaker.forced_reason:
+        return Response({'error': 'Only staff can reset this circuit'}, status=status.HTTP_403_FORBIDDEN)
+    breaker.reset()
+    return Response({**breaker.snapshot(), 'scope': 'process', 'pid': os.getpid()})
+
+@api_view(['GET'])
+def publish_analytics(request):
+    if not request.user:
+        return Response({'error': 'Not authenticated'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    platform = request.query_params.get('platform')
+    if platform and platform not in PLATFORM_LABELS:
+        return Response({'error': 'Unknown platform'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start, end = PublishAnalytics.date_range(request.query_params.get('from'), request.query_params.get('to'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(PublishAnalytics.summary(request.user.id, start, end, platform))
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file under MEDIA_ROOT with caching, ranges and optional offload"""
+    return MediaServer.respond(request, path)
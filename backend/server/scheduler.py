@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Scheduler for Social Postify
+Queues scheduled posts for the background workers when they come due
+
+Usage: python scheduler.py [--refresh-interval SECONDS] [--resync-interval SECONDS]
+Safe to run as several instances; each post is queued exactly once.
+"""
+
+import os
+import sys
+import time
+import django
+import argparse
+
+# Setup Django
+sys.path.append('.')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+django.setup()
+
+from function.scheduler import PostScheduler
+
+def run_scheduler(refresh_interval, resync_interval):
+    scheduler = PostScheduler()
+    print(f"Scheduler started: {scheduler.resync()} posts due within the lookahead window")
+    next_refresh = time.monotonic() + refresh_interval
+    next_resync = time.monotonic() + resync_interval
+
+    while True:
+        try:
+            due = scheduler.pop_due()
+            while due:
+                queued = scheduler.fire(due)
+                print(f"Queued {len(queued)} of {len(due)} due posts")
+                due = scheduler.pop_due()
+
+            if time.monotonic() >= next_resync:
+                scheduler.resync()
+                next_resync = time.monotonic() + resync_interval
+                next_refresh = time.monotonic() + refresh_interval
+            elif time.monotonic() >= next_refresh:
+                added = scheduler.refresh()
+                if added:
+                    print(f"Loaded {added} newly scheduled posts")
+                next_refresh = time.monotonic() + refresh_interval
+        except Exception as e:
+            print(f"Scheduler error: {e}")
+
+        wait = next_refresh - time.monotonic()
+        until_due = scheduler.seconds_until_next()
+        if until_due is not None:
+            wait = min(wait, until_due)
+        time.sleep(max(0.05, wait))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue scheduled posts when they come due")
+    parser.add_argument('--refresh-interval', type=float, default=5.0, help="seconds between incremental refreshes")
+    parser.add_argument('--resync-interval', type=float, default=300.0, help="seconds between full window reloads")
+    args = parser.parse_args()
+
+    try:
+        run_scheduler(args.refresh_interval, args.resync_interval)
+    except KeyboardInterrupt:
+        pass
@@ -10,11 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load .env from project root before any app module reads its configuration
+from dotenv import load_dotenv
+load_dotenv(BASE_DIR.parent.parent / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -72,10 +77,12 @@ WSGI_APPLICATION = 'server.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-# MongoDB with mongoengine
+# MongoDB with mongoengine; async views reach the same database through motor
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'social_postify')
+MONGO_URI = f"mongodb://{os.getenv('MONGO_HOST', 'localhost')}:{os.getenv('MONGO_PORT', '27017')}/{MONGO_DB_NAME}"
 try:
     import mongoengine
-    mongoengine.connect('social_postify', host='mongodb://localhost:27017/social_postify')
+    mongoengine.connect(MONGO_DB_NAME, host=MONGO_URI)
 except Exception as e:
     print(f"MongoDB connection failed: {e}")
     # Fallback to in-memory database for development
@@ -148,10 +155,12 @@ CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
     'authorization',
+    'content-range',
     'content-type',
     'dnt',
     'origin',
     'user-agent',
+    'x-chunk-sha256',
     'x-csrftoken',
     'x-requested-with',
 ]
@@ -159,9 +168,10 @@ CORS_ALLOW_HEADERS = [
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours
 SESSION_SAVE_EVERY_REQUEST = True
+# API login tokens (function.sessions); InMemorySessionStore only works with one process
+SESSION_STORE = os.getenv('SESSION_STORE', 'function.sessions.MongoSessionStore')
 
 # Media files
-import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
@@ -177,7 +187,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
-    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'function.authentication.BearerTokenAuthentication',
+    ],
     'UNAUTHENTICATED_USER': None,
     'UNAUTHENTICATED_TOKEN': None,
 }
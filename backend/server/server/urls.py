@@ -16,11 +16,9 @@ Including another URLconf
 """
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from function.views import serve_media
 
 urlpatterns = [
     path('', include('function.urls')),
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -2,14 +2,22 @@
 """
 Telegram Bot for Social Postify
 Posts all draft posts from database to Telegram
+
+Usage: python telegram_bot.py [--batch-size N] [--concurrency N] [--checkpoint PATH] [--reset]
+
+Drafts are read from MongoDB in _id order, one batch query at a time, and sent
+concurrently, capped by the Telegram rate limits in function.ratelimit. After
+every batch the sent posts are marked posted and the last _id is checkpointed,
+so a crashed run resumes where it stopped.
 """
 
 import os
 import sys
 import django
 import asyncio
-from dotenv import load_dotenv
-from telegram import Bot
+import argparse
+from datetime import datetime
+from bson import ObjectId
 
 # Setup Django
 sys.path.append('.')
@@ -17,49 +25,94 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 django.setup()
 
 from function.models import Post
+from function.services import TRANSIENT_ERRORS, TelegramService, run_blocking
 
-# Load environment variables
-load_dotenv(os.path.join('..', '..', '.env'))
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 CHAT_ID = os.getenv("CHAT_ID")
 
-async def post_all_drafts():
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return ObjectId(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def write_checkpoint(path, post_id):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(post_id))
+    os.replace(tmp_path, path)
+
+def fetch_draft_batch(after_id, batch_size):
+    """The next batch_size drafts after ``after_id``, by a fresh query
+
+    Each batch is its own short query, so no server-side cursor has to stay
+    open while the previous batch is being sent.
+    """
+    query = Post.objects(status='draft')
+    if after_id:
+        query = query.filter(id__gt=after_id)
+    return list(query.order_by('id').only('id', 'title', 'content', 'image_path', 'media_id').limit(batch_size))
+
+def mark_posted(post_ids):
+    return Post.objects(id__in=post_ids, status='draft').update(set__status='posted', set__posted_at=datetime.utcnow())
+
+async def send_batch(batch, semaphore):
+    async def send(post):
+        async with semaphore:
+            try:
+                success, message = await TelegramService.post_to_telegram(post, None)
+            except TRANSIENT_ERRORS as e:
+                # Raised for the circuit breakers; here it is one failed post,
+                # and the rest of the batch still has to be marked and checkpointed
+                success, message = False, f"Telegram error: {str(e)}"
+        if not success:
+            print(f"Failed to post '{post.title}': {message}")
+        return post.id if success else None
+
+    return [post_id for post_id in await asyncio.gather(*(send(post) for post in batch)) if post_id]
+
+async def post_all_drafts(batch_size=100, concurrency=30, checkpoint='.telegram_bot.checkpoint', reset=False):
     """Post all draft posts from database to Telegram"""
     if not TOKEN or not CHAT_ID:
         print("Telegram credentials not found in .env")
         return
-    
-    bot = Bot(token=TOKEN)
-    draft_posts = Post.objects(status='draft')
-    
-    if not draft_posts:
+
+    if reset and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    after_id = read_checkpoint(checkpoint)
+    if after_id:
+        print(f"Resuming after draft {after_id}")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    posted = failed = 0
+
+    while True:
+        batch = await run_blocking(fetch_draft_batch, after_id, batch_size)
+        if not batch:
+            break
+        after_id = batch[-1].id
+
+        sent = await send_batch(batch, semaphore)
+        if sent:
+            await run_blocking(mark_posted, sent)
+        await run_blocking(write_checkpoint, checkpoint, after_id)
+
+        posted += len(sent)
+        failed += len(batch) - len(sent)
+        print(f"Posted {posted} drafts ({failed} failed)")
+
+    if posted == 0 and failed == 0:
         print("No draft posts found")
-        return
-    
-    print(f"Posting {len(draft_posts)} draft posts to Telegram...")
-    
-    for post in draft_posts:
-        try:
-            caption = f"{post.title}\n\n{post.content}"
-            
-            # Send with image if available
-            if post.image_path and os.path.exists(post.image_path.replace('/media/', 'media/')):
-                image_path = post.image_path.replace('/media/', 'media/')
-                with open(image_path, "rb") as photo:
-                    await bot.send_photo(chat_id=CHAT_ID, photo=photo, caption=caption)
-                print(f"Posted with image: {post.title}")
-            else:
-                await bot.send_message(chat_id=CHAT_ID, text=caption)
-                print(f"Posted text: {post.title}")
-            
-            # Update status
-            post.status = 'posted'
-            from datetime import datetime
-            post.posted_at = datetime.utcnow()
-            post.save()
-            
-        except Exception as e:
-            print(f"Failed to post '{post.title}': {e}")
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
 
 if __name__ == "__main__":
-    asyncio.run(post_all_drafts())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Post all draft posts to Telegram")
+    parser.add_argument('--batch-size', type=int, default=100, help="drafts read and marked per batch")
+    parser.add_argument('--concurrency', type=int, default=30, help="sends in flight at once")
+    parser.add_argument('--checkpoint', default='.telegram_bot.checkpoint', help="file recording progress")
+    parser.add_argument('--reset', action='store_true', help="ignore any saved checkpoint")
+    args = parser.parse_args()
+
+    asyncio.run(post_all_drafts(args.batch_size, args.concurrency, args.checkpoint, args.reset))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Background worker for Social Postify
+Claims queued publish or image generation jobs from MongoDB and runs them
+
+Usage: python worker.py [--queue publish|generate] [--processes N] [--concurrency N] [--poll-interval SECONDS]
+"""
+
+import os
+import sys
+import django
+import asyncio
+import argparse
+import multiprocessing
+
+# Setup Django
+sys.path.append('.')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+django.setup()
+
+from function.jobs import GenerationJobQueue, PublishJobQueue, JOB_LEASE_SECONDS, JOB_REAP_INTERVAL, new_worker_id
+from function.services import run_blocking
+
+QUEUES = {
+    'publish': PublishJobQueue,
+    'generate': GenerationJobQueue,
+}
+
+def describe(job, result):
+    if result is None:
+        return f"Job {job.id} failed"
+    if isinstance(result, list):
+        succeeded = sum(1 for r in result if r['success'])
+        return f"Job {job.id} done: {succeeded}/{len(result)} platforms succeeded"
+    return f"Job {job.id} done: {result}"
+
+async def keep_leased(queue, job, worker_id):
+    """Renew the job's lease until cancelled"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            if not await run_blocking(queue.renew, job, worker_id):
+                print(f"Lost the lease on job {job.id}")
+                return
+        except Exception as e:
+            print(f"Failed to renew the lease on job {job.id}: {e}")
+
+async def run_slot(queue, worker_id, poll_interval):
+    """Claim and run one job at a time until interrupted"""
+    while True:
+        try:
+            job = await run_blocking(queue.claim, worker_id)
+        except Exception as e:
+            print(f"Failed to claim job: {e}")
+            job = None
+
+        if not job:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        print(f"Running job {job.id} (attempt {job.attempts})")
+        heartbeat = asyncio.ensure_future(keep_leased(queue, job, worker_id))
+        try:
+            print(describe(job, await queue.run(job, worker_id)))
+        except Exception as e:
+            # Usually MongoDB failing the final status write; the lease
+            # expires and the job is retried or reaped
+            print(f"Job {job.id} errored: {e}")
+        finally:
+            heartbeat.cancel()
+
+async def reap_abandoned(queue, interval):
+    """Fail jobs that ran out of attempts, however busy the queue is"""
+    while True:
+        try:
+            failed = await run_blocking(queue.fail_abandoned)
+            if failed:
+                print(f"Failed {failed} abandoned jobs")
+        except Exception as e:
+            print(f"Failed to reap abandoned jobs: {e}")
+        await asyncio.sleep(interval)
+
+async def run_worker(queue_name, poll_interval, concurrency):
+    worker_id = new_worker_id()
+    print(f"Worker {worker_id} started on the {queue_name} queue with {concurrency} slots")
+    queue = QUEUES[queue_name]
+    await asyncio.gather(
+        reap_abandoned(queue, JOB_REAP_INTERVAL),
+        *(run_slot(queue, worker_id, poll_interval) for _ in range(concurrency)),
+    )
+
+def worker_process(queue_name, poll_interval, concurrency):
+    try:
+        asyncio.run(run_worker(queue_name, poll_interval, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Social Postify background workers")
+    parser.add_argument('--queue', choices=sorted(QUEUES), default='publish', help="which job queue to work on")
+    parser.add_argument('--processes', type=int, default=1, help="number of worker processes")
+    parser.add_argument('--concurrency', type=int, default=1, help="jobs run at once by each process")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds to wait when the queue is empty")
+    args = parser.parse_args()
+    worker_args = (args.queue, args.poll_interval, args.concurrency)
+
+    if args.processes <= 1:
+        worker_process(*worker_args)
+    else:
+        # MongoDB clients are not fork-safe, so every process starts fresh
+        ctx = multiprocessing.get_context('spawn')
+        processes = [ctx.Process(target=worker_process, args=worker_args) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
@@ -15,6 +15,7 @@ import apiService from "../services/api.js";
 const CreatePost = () => {
   const [prompt, setPrompt] = useState("");
   const [generatedImage, setGeneratedImage] = useState(null);
+  const [generatedMediaId, setGeneratedMediaId] = useState(null);
   const [uploadedImages, setUploadedImages] = useState([]);
   const [title, setTitle] = useState("");
   const [caption, setCaption] = useState("");
@@ -33,8 +34,9 @@ const CreatePost = () => {
     setIsGenerating(true);
     try {
       const response = await apiService.generateImage(prompt);
-      if (response.image_base64) {
-        setGeneratedImage(`data:image/png;base64,${response.image_base64}`);
+      if (response.media_id) {
+        setGeneratedImage(apiService.mediaUrl(response.url));
+        setGeneratedMediaId(response.media_id);
         toast({ title: "Image generated successfully!" });
       }
     } catch (error) {
@@ -79,6 +81,10 @@ const CreatePost = () => {
       // Add image if available
       if (uploadedImages.length > 0) {
         postData.image = uploadedImages[0].file;
+      } else if (generatedMediaId) {
+        // Generated images are already stored on the server
+        postData.media_id = generatedMediaId;
+        postData.generated_image_prompt = prompt;
       }
 
       const post = await apiService.createPost(postData);
@@ -118,6 +124,7 @@ const CreatePost = () => {
         setSelectedPlatforms([]);
         setUploadedImages([]);
         setGeneratedImage(null);
+        setGeneratedMediaId(null);
         setPrompt('');
       } else {
         toast({ 
@@ -190,7 +197,7 @@ const CreatePost = () => {
               </Button>
 
               {generatedImage && (
-                <PreviewImage src={generatedImage} alt="Generated content" onRemove={() => setGeneratedImage(null)} />
+                <PreviewImage src={generatedImage} alt="Generated content" onRemove={() => { setGeneratedImage(null); setGeneratedMediaId(null); }} />
               )}
             </CardContent>
           </Card>
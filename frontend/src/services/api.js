@@ -90,8 +90,12 @@ class ApiService {
   }
 
   // Posts endpoints
-  async getPosts() {
-    return this.request('/posts/');
+  // Returns { results, next_cursor }; pass next_cursor back as `cursor` for the next page
+  async getPosts(params = {}) {
+    const query = new URLSearchParams(
+      Object.entries(params).filter(([, value]) => value !== undefined && value !== null && value !== '')
+    ).toString();
+    return this.request(query ? `/posts/?${query}` : '/posts/');
   }
 
   async createPost(postData) {
@@ -167,6 +171,53 @@ class ApiService {
     }
   }
 
+  // Like publishPost, but calls onResult(result) as each platform finishes.
+  // Resolves with the final results list.
+  async publishPostStream(postId, publishData, onResult) {
+    if (!this.token) {
+      throw new Error('Not logged in. Please login first.');
+    }
+
+    const formData = new FormData();
+    formData.append('platforms', JSON.stringify(publishData.platforms));
+    formData.append('credentials', JSON.stringify(publishData.credentials || {}));
+
+    const response = await fetch(`${API_BASE_URL}/posts/${postId}/publish/stream/?format=ndjson`, {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${this.token}`,
+      },
+      body: formData,
+    });
+    if (!response.ok) {
+      const error = await response.text();
+      throw new Error(`Publish failed: ${error}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line) continue;
+        const { event, data } = JSON.parse(line);
+        if (event === 'result' && onResult) onResult(data);
+        if (event === 'done') return data.results;
+      }
+    }
+    throw new Error('Publish stream ended unexpectedly');
+  }
+
+  // Absolute URL for a server media path such as /media/objects/...
+  mediaUrl(path) {
+    return `${API_BASE_URL.replace(/\/api$/, '')}${path}`;
+  }
+
   async generateImage(prompt) {
     return this.request('/posts/generate_image/', {
       method: 'POST',